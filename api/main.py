@@ -1,23 +1,39 @@
 import asyncio
+import base64
+import hashlib
 import json
 import os
 import re
 import math
+import multiprocessing
 import random
+import secrets
+import sqlite3
 import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
 from typing import AsyncIterator, Optional, Dict, Any, List
+from urllib.parse import quote, urlencode
 
 import httpx
+import numpy as np
+import websockets
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 
 # Add extraction directory to Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
-from extraction.github_extractor import GitHubExtractor
+from extraction.github_extractor import EXTENSION_LANGUAGES, GitHubExtractor, interesting_excerpt
 
 _project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 load_dotenv(os.path.join(_project_root, ".env.local"))
@@ -29,87 +45,39 @@ DEFAULT_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "Xb7hH8MSUJpSbSDYk0k2").stri
 DEFAULT_MODEL_ID = os.getenv("ELEVENLABS_MODEL_ID", "eleven_turbo_v2_5").strip()
 DEFAULT_OUTPUT_FORMAT = os.getenv("ELEVENLABS_OUTPUT_FORMAT", "mp3_44100_128").strip()
 DEFAULT_STREAMING_LATENCY = os.getenv("ELEVENLABS_STREAMING_LATENCY", "0").strip()
+# Base URL for the streaming-input WebSocket (override to point at a local stand-in)
+ELEVENLABS_WS_BASE = os.getenv("ELEVENLABS_WS_BASE", "wss://api.elevenlabs.io").strip().rstrip("/")
 
 # Anthropic API key (for placard generation with Claude)
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "").strip()
 print(f"[startup] ANTHROPIC_API_KEY={'SET' if ANTHROPIC_API_KEY else 'MISSING'}")
 
-# Vertex AI config - Instance 1
-GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", "").strip()
-GCP_LOCATION = os.getenv("GCP_LOCATION", "us-central1").strip()
-_vertex_credentials = None
+# Background tasks started with the app (the coroutines are defined further down)
+_background_tasks: set = set()
 
-# Try loading credentials from JSON string (for Vercel/production)
-_vertex_creds_json = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON", "").strip()
-if _vertex_creds_json:
-    try:
-        import json
-        from google.oauth2 import service_account
-        import google.auth.transport.requests as google_requests
-        _creds_dict = json.loads(_vertex_creds_json)
-        _vertex_credentials = service_account.Credentials.from_service_account_info(
-            _creds_dict,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
-        )
-        print(f"[startup] Vertex AI #1 credentials loaded from GOOGLE_APPLICATION_CREDENTIALS_JSON env var")
-    except Exception as e:
-        print(f"[startup] Failed to load Vertex AI #1 credentials from JSON: {e}")
-# Fallback to file path (for local development)
-elif _vertex_key_path := os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "").strip():
-    if os.path.exists(_vertex_key_path):
-        from google.oauth2 import service_account
-        import google.auth.transport.requests as google_requests
-        _vertex_credentials = service_account.Credentials.from_service_account_file(
-            _vertex_key_path,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
-        )
-        print(f"[startup] Vertex AI #1 credentials loaded from {_vertex_key_path}")
 
-# Vertex AI config - Instance 2 (for parallel processing)
-GCP_PROJECT_ID_2 = os.getenv("GCP_PROJECT_ID_2", "").strip()
-GCP_LOCATION_2 = os.getenv("GCP_LOCATION_2", "us-central1").strip()
-_vertex_credentials_2 = None
+def _spawn_background(coro) -> asyncio.Task:
+    """Start a fire-and-forget task, keeping a reference so it is not garbage collected."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
-# Try loading credentials from JSON string (for Vercel/production)
-_vertex_creds_json_2 = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON_2", "").strip()
-if _vertex_creds_json_2:
-    try:
-        from google.oauth2 import service_account
-        _creds_dict_2 = json.loads(_vertex_creds_json_2)
-        _vertex_credentials_2 = service_account.Credentials.from_service_account_info(
-            _creds_dict_2,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
-        )
-        print(f"[startup] Vertex AI #2 credentials loaded from GOOGLE_APPLICATION_CREDENTIALS_JSON_2 env var")
-    except Exception as e:
-        print(f"[startup] Failed to load Vertex AI #2 credentials from JSON: {e}")
-# Fallback to file path (for local development)
-elif _vertex_key_path_2 := os.getenv("GOOGLE_APPLICATION_CREDENTIALS_2", "").strip():
-    if os.path.exists(_vertex_key_path_2):
-        from google.oauth2 import service_account
-        _vertex_credentials_2 = service_account.Credentials.from_service_account_file(
-            _vertex_key_path_2,
-            scopes=["https://www.googleapis.com/auth/cloud-platform"],
-        )
-        print(f"[startup] Vertex AI #2 credentials loaded from {_vertex_key_path_2}")
 
-# Status check
-if _vertex_credentials and _vertex_credentials_2:
-    print(f"[startup] ✅ DUAL Vertex AI instances configured (2x speed)")
-elif _vertex_credentials:
-    print(f"[startup] ✅ Single Vertex AI instance configured")
-else:
-    print(f"[startup] ⚠️  Vertex AI credentials NOT found, falling back to Gemini API keys")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fork analysis workers before any background threads exist
+    _analysis_pool.start()
+    _spawn_background(_met_warm_cache_loop())
+    _spawn_background(_vertex_token_refresh_loop())
+    yield
+    for task in list(_background_tasks):
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _analysis_pool.shutdown()
 
-# Fallback: Gemini API keys (free tier, rate limited)
-_gemini_keys = []
-for _k in [os.getenv("GEMINI_API_KEY", ""), os.getenv("GEMINI_API_KEY_2", ""), os.getenv("GEMINI_API_KEY_3", "")]:
-    _k = _k.strip()
-    if _k:
-        _gemini_keys.append(_k)
-_gemini_key_index = 0
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 cors_origins = os.getenv(
     "CORS_ORIGINS",
@@ -135,21 +103,49 @@ class TTSRequest(BaseModel):
     text: str = Field(..., min_length=1)
     voice_id: Optional[str] = None
     model_id: Optional[str] = None
+    parallel: bool = False
+
+
+# Sentence-parallel synthesis: how many chunks may be in flight at once, and
+# how many characters are packed into each chunk after the first sentence.
+TTS_PARALLELISM = max(1, int(os.getenv("ELEVENLABS_PARALLELISM", "3").strip() or 3))
+TTS_CHUNK_CHARS = max(1, int(os.getenv("ELEVENLABS_CHUNK_CHARS", "240").strip() or 240))
+# Attempts per chunk before the stream ends early; 429s wait out Retry-After
+TTS_CHUNK_ATTEMPTS = max(1, int(os.getenv("ELEVENLABS_CHUNK_ATTEMPTS", "3").strip() or 3))
+TTS_RETRY_DEFAULT_SECONDS = 2.0
+# Fragments shorter than this ("Dr.", "e.g.") are joined to the next sentence
+TTS_MIN_SENTENCE_CHARS = 24
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+ELEVENLABS_VOICE_SETTINGS = {
+    "stability": 0.35,
+    "similarity_boost": 0.7,
+    "style": 0.2,
+    "use_speaker_boost": True,
+}
 
 
-async def stream_elevenlabs_audio(
-    text: str,
-    voice_id: Optional[str],
-    model_id: Optional[str],
-) -> AsyncIterator[bytes]:
+def _resolve_voice_id(voice_id: Optional[str]) -> str:
     if not ELEVENLABS_API_KEY:
         raise HTTPException(status_code=500, detail="Missing ELEVENLABS_API_KEY")
 
     resolved_voice_id = (voice_id or DEFAULT_VOICE_ID).strip()
     if not resolved_voice_id:
         raise HTTPException(status_code=400, detail="Missing voice_id")
+    return resolved_voice_id
+
 
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{resolved_voice_id}/stream"
+async def _send_elevenlabs_request(
+    client: httpx.AsyncClient,
+    text: str,
+    voice_id: str,
+    model_id: Optional[str],
+    previous_text: Optional[str] = None,
+    next_text: Optional[str] = None,
+) -> httpx.Response:
+    """Open a streaming ElevenLabs TTS response, raising HTTPException on upstream errors."""
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
     headers = {
         "xi-api-key": ELEVENLABS_API_KEY,
         "accept": "audio/mpeg",
@@ -164,16 +160,14 @@ async def stream_elevenlabs_audio(
     payload = {
         "text": text,
         "model_id": resolved_model_id,
-        "voice_settings": {
-            "stability": 0.35,
-            "similarity_boost": 0.7,
-            "style": 0.2,
-            "use_speaker_boost": True,
-        },
+        "voice_settings": ELEVENLABS_VOICE_SETTINGS,
     }
+    # Neighbouring text keeps intonation continuous across stitched chunks
+    if previous_text:
+        payload["previous_text"] = previous_text
+    if next_text:
+        payload["next_text"] = next_text
 
-    timeout = httpx.Timeout(30.0, connect=10.0)
-    client = httpx.AsyncClient(timeout=timeout)
     request = client.build_request(
         "POST",
         url,
@@ -186,9 +180,31 @@ async def stream_elevenlabs_audio(
     if response.status_code >= 400:
         error_body = await response.aread()
         await response.aclose()
-        await client.aclose()
         detail = error_body.decode("utf-8", errors="ignore") or "ElevenLabs error"
-        raise HTTPException(status_code=response.status_code, detail=detail)
+        retry_after = response.headers.get("retry-after")
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=detail,
+            headers={"Retry-After": retry_after} if retry_after else None,
+        )
+
+    return response
+
+
+async def stream_elevenlabs_audio(
+    text: str,
+    voice_id: Optional[str],
+    model_id: Optional[str],
+) -> AsyncIterator[bytes]:
+    resolved_voice_id = _resolve_voice_id(voice_id)
+
+    timeout = httpx.Timeout(30.0, connect=10.0)
+    client = httpx.AsyncClient(timeout=timeout)
+    try:
+        response = await _send_elevenlabs_request(client, text, resolved_voice_id, model_id)
+    except BaseException:
+        await client.aclose()
+        raise
 
     async def iterator() -> AsyncIterator[bytes]:
         try:
@@ -202,13 +218,165 @@ async def stream_elevenlabs_audio(
     return iterator()
 
 
+def split_tts_sentences(text: str, max_chars: int = TTS_CHUNK_CHARS) -> List[str]:
+    """
+    Split text at sentence boundaries for parallel synthesis.
+
+    The first chunk is always a single sentence so audio starts as early as
+    possible; later sentences are packed into chunks of up to max_chars.
+    Fragments under TTS_MIN_SENTENCE_CHARS (a split after "Dr.") are joined
+    to the following sentence so no chunk is too short to carry prosody.
+    """
+    sentences: List[str] = []
+    pending = ""
+    for fragment in _SENTENCE_BOUNDARY.split(text.strip()):
+        fragment = fragment.strip()
+        if not fragment:
+            continue
+        pending = f"{pending} {fragment}" if pending else fragment
+        if len(pending) >= TTS_MIN_SENTENCE_CHARS:
+            sentences.append(pending)
+            pending = ""
+    if pending:
+        if sentences:
+            sentences[-1] = f"{sentences[-1]} {pending}"
+        else:
+            sentences.append(pending)
+    if not sentences:
+        return []
+
+    chunks = [sentences[0]]
+    current = ""
+    for sentence in sentences[1:]:
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def stream_elevenlabs_audio_parallel(
+    text: str,
+    voice_id: Optional[str],
+    model_id: Optional[str],
+) -> AsyncIterator[bytes]:
+    """
+    Synthesize sentence chunks concurrently and stitch them into one MP3 stream.
+
+    At most TTS_PARALLELISM chunks are synthesized at once. Each chunk buffers
+    into its own queue; the first chunk is relayed as it arrives and the rest
+    are drained strictly in order, so the output is one continuous stream.
+
+    A chunk that fails (a 429 from the account concurrency limit, a 5xx or a
+    dropped connection) is re-synthesized, up to TTS_CHUNK_ATTEMPTS times,
+    as long as none of its audio has been relayed yet. The stream only ends
+    early if that also fails.
+    """
+    chunks = split_tts_sentences(text)
+    if len(chunks) <= 1:
+        return await stream_elevenlabs_audio(text, voice_id, model_id)
+
+    resolved_voice_id = _resolve_voice_id(voice_id)
+    print(f"[tts] Parallel synthesis: {len(chunks)} chunks, parallelism={TTS_PARALLELISM}")
+
+    timeout = httpx.Timeout(30.0, connect=10.0)
+    client = httpx.AsyncClient(timeout=timeout)
+    semaphore = asyncio.Semaphore(TTS_PARALLELISM)
+    queues: List[asyncio.Queue] = [asyncio.Queue() for _ in chunks]
+    # Set once the consumer has taken audio from a chunk; after that a retry would repeat it
+    relayed = [False] * len(chunks)
+
+    async def synthesize(index: int) -> None:
+        queue = queues[index]
+        try:
+            for attempt in range(1, TTS_CHUNK_ATTEMPTS + 1):
+                try:
+                    async with semaphore:
+                        response = await _send_elevenlabs_request(
+                            client,
+                            chunks[index],
+                            resolved_voice_id,
+                            model_id,
+                            previous_text=chunks[index - 1] if index > 0 else None,
+                            next_text=chunks[index + 1] if index + 1 < len(chunks) else None,
+                        )
+                        try:
+                            async for chunk in response.aiter_bytes():
+                                if chunk:
+                                    queue.put_nowait(chunk)
+                        finally:
+                            await response.aclose()
+                    return
+                except Exception as e:
+                    retryable = isinstance(e, httpx.TransportError) or (
+                        isinstance(e, HTTPException) and (e.status_code == 429 or e.status_code >= 500)
+                    )
+                    if not retryable or relayed[index] or attempt == TTS_CHUNK_ATTEMPTS:
+                        queue.put_nowait(e)
+                        return
+                    # Nothing from this chunk has been relayed, so partial audio can be dropped
+                    while not queue.empty():
+                        queue.get_nowait()
+                    wait = TTS_RETRY_DEFAULT_SECONDS * attempt
+                    retry_after = (getattr(e, "headers", None) or {}).get("Retry-After")
+                    if retry_after:
+                        try:
+                            wait = max(float(retry_after), 1.0)
+                        except ValueError:
+                            pass
+                    print(f"[tts] Chunk {index + 1}/{len(chunks)} failed ({e}), retrying in {wait:.0f}s...")
+                    await asyncio.sleep(wait)
+        finally:
+            queue.put_nowait(None)
+
+    tasks = [asyncio.create_task(synthesize(i)) for i in range(len(chunks))]
+
+    async def shutdown() -> None:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await client.aclose()
+
+    # Wait for the first audio bytes so upstream errors still surface as HTTP errors
+    first = await queues[0].get()
+    relayed[0] = True
+    if first is None or isinstance(first, Exception):
+        await shutdown()
+        if isinstance(first, HTTPException):
+            raise first
+        raise HTTPException(status_code=502, detail=f"ElevenLabs error: {first}")
+
+    async def iterator() -> AsyncIterator[bytes]:
+        try:
+            yield first
+            for index, queue in enumerate(queues):
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        print(f"[tts] Chunk {index + 1}/{len(chunks)} failed, ending stream early: {item}")
+                        return
+                    relayed[index] = True
+                    yield item
+        finally:
+            await shutdown()
+
+    return iterator()
+
+
 @app.get("/api/tts")
 async def tts_get(
     text: str = Query(..., min_length=1, max_length=5000),
     voice_id: Optional[str] = None,
     model_id: Optional[str] = None,
+    parallel: bool = False,
 ):
-    audio_stream = await stream_elevenlabs_audio(
+    stream = stream_elevenlabs_audio_parallel if parallel else stream_elevenlabs_audio
+    audio_stream = await stream(
         text=text,
         voice_id=voice_id,
         model_id=model_id,
@@ -218,7 +386,8 @@ async def tts_get(
 
 @app.post("/api/tts")
 async def tts_post(payload: TTSRequest):
-    audio_stream = await stream_elevenlabs_audio(
+    stream = stream_elevenlabs_audio_parallel if payload.parallel else stream_elevenlabs_audio
+    audio_stream = await stream(
         text=payload.text,
         voice_id=payload.voice_id,
         model_id=payload.model_id,
@@ -226,6 +395,304 @@ async def tts_post(payload: TTSRequest):
     return StreamingResponse(audio_stream, media_type="audio/mpeg")
 
 
+@app.websocket("/api/tts/ws")
+async def tts_websocket(
+    websocket: WebSocket,
+    voice_id: Optional[str] = None,
+    model_id: Optional[str] = None,
+):
+    """
+    Incremental TTS over a WebSocket, relayed through ElevenLabs' stream-input API.
+
+    The client sends JSON messages {"text": "..."} as text becomes available
+    (add "flush": true to force generation of buffered text) and {"text": ""}
+    to end input. Audio comes back as binary MP3 frames as soon as ElevenLabs
+    produces them, followed by a final {"isFinal": true} JSON message.
+    """
+    await websocket.accept()
+    try:
+        resolved_voice_id = _resolve_voice_id(voice_id)
+    except HTTPException as e:
+        await websocket.close(code=1011, reason=str(e.detail)[:120])
+        return
+
+    resolved_model_id = (model_id or DEFAULT_MODEL_ID).strip()
+    query = urlencode({
+        "model_id": resolved_model_id,
+        "output_format": DEFAULT_OUTPUT_FORMAT,
+        "optimize_streaming_latency": DEFAULT_STREAMING_LATENCY,
+    })
+    url = f"{ELEVENLABS_WS_BASE}/v1/text-to-speech/{quote(resolved_voice_id, safe='')}/stream-input?{query}"
+
+    try:
+        async with websockets.connect(url, additional_headers={"xi-api-key": ELEVENLABS_API_KEY}) as upstream:
+            # Initial message opens the stream; ElevenLabs requires a single space here
+            await upstream.send(json.dumps({"text": " ", "voice_settings": ELEVENLABS_VOICE_SETTINGS}))
+
+            async def pump_text() -> None:
+                while True:
+                    message = await websocket.receive_json()
+                    text = message.get("text") or ""
+                    if not text:
+                        await upstream.send(json.dumps({"text": ""}))
+                        return
+                    frame = {"text": text}
+                    if message.get("flush"):
+                        frame["flush"] = True
+                    await upstream.send(json.dumps(frame))
+
+            async def pump_audio() -> None:
+                async for raw in upstream:
+                    data = json.loads(raw)
+                    if data.get("error"):
+                        print(f"[tts] ElevenLabs stream error: {data.get('message') or data['error']}")
+                        await websocket.send_json({"error": data.get("message") or data["error"]})
+                        return
+                    if data.get("audio"):
+                        await websocket.send_bytes(base64.b64decode(data["audio"]))
+                    if data.get("isFinal"):
+                        break
+                await websocket.send_json({"isFinal": True})
+
+            text_task = asyncio.create_task(pump_text())
+            audio_task = asyncio.create_task(pump_audio())
+            try:
+                done, _ = await asyncio.wait({text_task, audio_task}, return_when=asyncio.FIRST_COMPLETED)
+                # Input finished cleanly: keep relaying until the last audio frame
+                if text_task in done and text_task.exception() is None:
+                    await audio_task
+                elif audio_task in done:
+                    audio_task.result()
+            finally:
+                for task in (text_task, audio_task):
+                    task.cancel()
+                await asyncio.gather(text_task, audio_task, return_exceptions=True)
+    except WebSocketDisconnect:
+        print("[tts] WebSocket client disconnected")
+        return
+    except Exception as e:
+        print(f"[tts] WebSocket relay failed: {e}")
+        try:
+            await websocket.close(code=1011, reason="TTS relay failed")
+        except Exception:
+            pass
+        return
+
+    try:
+        await websocket.close()
+    except Exception:
+        pass
+
+
+# ============================================
+# Persistent Cache (SQLite)
+# ============================================
+
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(_project_root, ".cache")).strip()
+CACHE_DB_PATH = os.path.join(CACHE_DIR, "syntaxesia.sqlite3")
+
+
+class PersistentTTLCache:
+    """
+    SQLite-backed key/value cache with per-entry TTL and LRU eviction.
+
+    Values are stored as JSON. Every hit refreshes the entry's last-used time,
+    and once the table grows past max_entries the least recently used rows are
+    evicted. The row count is tracked as rows are written and deleted, so
+    eviction only touches indexed ranges. Hit/miss counters are kept for the
+    process lifetime.
+    """
+
+    _EVICT_EVERY = 64  # writes between size checks
+
+    def __init__(self, table: str, max_entries: int, ttl_seconds: float, path: str = CACHE_DB_PATH):
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_used ON {table} (last_used)")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)")
+        self._rows = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._rows -= self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,)).rowcount
+                self.misses += 1
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Look up many keys at once, returning only live entries.
+
+        Bulk lookups are probes rather than cache reads, so they are left out
+        of the hit/miss counters.
+        """
+        now = time.time()
+        found: Dict[str, Any] = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i+500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM {self.table} WHERE key IN ({placeholders}) AND expires_at >= ?",
+                    (*batch, now),
+                ).fetchall()
+                for key, value in rows:
+                    found[key] = json.loads(value)
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE {self.table} SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        (now, *(key for key, _ in rows)),
+                    )
+        return found
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        now = time.time()
+        expires_at = now + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        value = json.dumps(value)
+        with self._lock:
+            updated = self._conn.execute(
+                f"UPDATE {self.table} SET value = ?, expires_at = ?, last_used = ? WHERE key = ?",
+                (value, expires_at, now, key),
+            ).rowcount
+            if not updated:
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                    (key, value, expires_at, now),
+                )
+                self._rows += 1
+            self._writes += 1
+            if self._writes % self._EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._rows -= self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,)).rowcount
+        if self._rows > self.max_entries:
+            self._rows -= self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY last_used ASC LIMIT ?)",
+                (self._rows - self.max_entries,),
+            ).rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class MemoryLRUCache:
+    """In-process stand-in for PersistentTTLCache when persistence is turned off."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key]
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class ImageStore:
+    """
+    Content-addressed PNG store on disk, evicting least recently used files.
+
+    Files are named by the SHA-256 of their bytes. Reads bump the file's
+    mtime, and writes evict the oldest files once the store grows past
+    max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.png")
+
+    def path(self, digest: str) -> Optional[str]:
+        """Return the file path for a stored image (marking it recently used), or None."""
+        if not re.fullmatch(r"[0-9a-f]{64}", digest):
+            return None
+        path = self._path(digest)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def contains(self, digest: str) -> bool:
+        return self.path(digest) is not None
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._evict()
+        return digest
+
+    def _evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".png"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
 # ============================================
 # Met Museum Women Artists Search
 # ============================================
@@ -233,6 +700,25 @@ async def tts_post(payload: TTSRequest):
 import random
 
 MET_API_BASE = "https://collectionapi.metmuseum.org/public/collection/v1"
+MET_HEADERS = {"User-Agent": "SyntaxesiaApp/1.0"}
+
+# Met responses change rarely; cache objects for a week and search ID lists for a day
+_met_object_cache = PersistentTTLCache(
+    "met_objects",
+    max_entries=int(os.getenv("MET_OBJECT_CACHE_SIZE", "20000")),
+    ttl_seconds=float(os.getenv("MET_OBJECT_CACHE_TTL", str(7 * 24 * 3600))),
+)
+# Learned object-ID -> "by a woman artist" verdicts, used to order live candidates
+_met_artist_verdicts = PersistentTTLCache(
+    "met_artist_verdicts",
+    max_entries=int(os.getenv("MET_VERDICT_CACHE_SIZE", "500000")),
+    ttl_seconds=float(os.getenv("MET_VERDICT_CACHE_TTL", str(90 * 24 * 3600))),
+)
+_met_search_cache = PersistentTTLCache(
+    "met_searches",
+    max_entries=int(os.getenv("MET_SEARCH_CACHE_SIZE", "2000")),
+    ttl_seconds=float(os.getenv("MET_SEARCH_CACHE_TTL", str(24 * 3600))),
+)
 
 # Hardcoded keyword -> objectID mappings (curated from met_women_artists.json)
 HARDCODED_KEYWORDS = {
@@ -245,11 +731,93 @@ HARDCODED_KEYWORDS = {
     "contemporary":   [286114, 10344, 20194, 78569, 11554, 14676, 14822, 19838],
 }
 
-# Load curated women artist names at startup
+# Local search over the curated dataset: BM25 with per-field term weights
+MET_INDEX_FIELD_WEIGHTS = {
+    "keywords": 3.0,
+    "title": 2.0,
+    "artist": 2.0,
+    "medium": 1.0,
+    "department": 1.0,
+}
+MET_RESULT_LIMIT = 8
+# Live fallback: object fetches kept in flight, and the cap on fetches per query
+MET_LIVE_CONCURRENCY = max(1, int(os.getenv("MET_LIVE_CONCURRENCY", "10")))
+MET_LIVE_MAX_FETCHES = 500
+# Only this head of a /search ID list (relevance order) is checked against known verdicts
+MET_VERDICT_LOOKUP_MAX = MET_LIVE_MAX_FETCHES * 4
+# How long a streamed search's live candidate plan stays resumable via its cursor
+MET_CURSOR_TTL = 3600
+
+_TOKEN_RE = re.compile(r"\w+")
+_STOPWORDS = {"a", "an", "and", "by", "for", "in", "of", "on", "or", "the", "to", "with"}
+
+
+def _tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if len(token) < 2 or token in _STOPWORDS:
+            continue
+        # Crude plural folding so "textiles" matches "textile"
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class MetInvertedIndex:
+    """In-memory inverted index with BM25 ranking over the curated Met dataset."""
+
+    def __init__(self, items: List[Dict[str, Any]], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = items
+        self.postings: Dict[str, List[tuple]] = {}
+
+        lengths = []
+        for doc_index, item in enumerate(items):
+            term_freqs: Dict[str, float] = {}
+            length = 0.0
+            for field, weight in MET_INDEX_FIELD_WEIGHTS.items():
+                value = item.get(field) or ""
+                if isinstance(value, list):
+                    value = " ".join(value)
+                for token in _tokenize(value):
+                    term_freqs[token] = term_freqs.get(token, 0.0) + weight
+                    length += weight
+            lengths.append(length)
+            for token, tf in term_freqs.items():
+                self.postings.setdefault(token, []).append((doc_index, tf))
+
+        avg_length = (sum(lengths) / len(lengths)) if lengths else 1.0
+        # Length normalisation is per-document, so precompute it once
+        self._norms = [k1 * (1 - b + b * length / avg_length) for length in lengths]
+        total = len(items)
+        self._idf = {
+            token: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for token, postings in self.postings.items()
+        }
+
+    def search(self, query: str, limit: int = MET_RESULT_LIMIT) -> List[Dict[str, Any]]:
+        """Return up to `limit` dataset items ranked by BM25 score for the query."""
+        scores: Dict[int, float] = {}
+        for token in set(_tokenize(query)):
+            idf = self._idf.get(token)
+            if idf is None:
+                continue
+            for doc_index, tf in self.postings[token]:
+                score = idf * tf * (self.k1 + 1) / (tf + self._norms[doc_index])
+                scores[doc_index] = scores.get(doc_index, 0.0) + score
+        ranked = sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+        return [self.docs[doc_index] for doc_index, _ in ranked[:limit]]
+
+
+# Load curated women artist names, object IDs and the local search index at startup
 _women_artist_names: set = set()
+_curated_object_ids: set = set()
+_met_index = MetInvertedIndex([])
 
 def _load_women_artists():
-    global _women_artist_names
+    global _women_artist_names, _curated_object_ids, _met_index
     json_path = os.path.join(os.path.dirname(__file__), "..", "public", "met_women_artists.json")
     try:
         with open(json_path) as f:
@@ -258,123 +826,380 @@ def _load_women_artists():
             item["artist"].lower().strip()
             for item in items if item.get("artist")
         )
+        _curated_object_ids = set(int(item["objectID"]) for item in items if item.get("objectID"))
         print(f"[met] Loaded {len(_women_artist_names)} curated women artist names")
+        _met_index = MetInvertedIndex(items)
+        print(f"[met] Indexed {len(items)} artworks ({len(_met_index.postings)} terms)")
     except Exception as e:
         print(f"[met] Failed to load women artists JSON: {e}")
 
 _load_women_artists()
 
 
+def _met_artwork(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a Met /objects response into the artwork dict returned to the client."""
+    return {
+        "url": obj.get("primaryImage") or obj.get("primaryImageSmall"),
+        "title": obj.get("title", "Untitled"),
+        "artist": obj.get("artistDisplayName") or obj.get("culture") or "Unknown",
+        "date": obj.get("objectDate", ""),
+        "medium": obj.get("medium", ""),
+        "department": obj.get("department", ""),
+        "description": obj.get("creditLine") or obj.get("department", ""),
+    }
+
+
+async def _fetch_met_object(client: httpx.AsyncClient, oid: int, refresh: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Fetch a Met object through the persistent cache. Missing objects cache as {}.
+
+    With refresh=True the cache is bypassed, falling back to the cached copy
+    only if the Met request fails.
+    """
+    key = str(oid)
+    obj = _met_object_cache.get(key)
+    if obj is not None and not refresh:
+        return obj
+    stale = obj
+    try:
+        r = await client.get(f"{MET_API_BASE}/objects/{oid}")
+    except Exception:
+        return stale
+    if r.status_code == 404:
+        _met_object_cache.set(key, {})
+        return {}
+    if r.status_code != 200:
+        return stale
+    try:
+        obj = r.json()
+    except Exception:
+        return stale
+    _met_object_cache.set(key, obj)
+    _met_artist_verdicts.set(key, _is_woman_artist(obj))
+    return obj
+
+
+async def _fetch_met_search_ids(client: httpx.AsyncClient, q: str) -> Optional[List[int]]:
+    """Run a Met /search through the query cache; None means the search API failed."""
+    key = " ".join(q.lower().split())
+    object_ids = _met_search_cache.get(key)
+    if object_ids is not None:
+        return object_ids
+    resp = await client.get(f"{MET_API_BASE}/search", params={"q": q, "hasImages": "true"})
+    if resp.status_code != 200:
+        print(f"[met] Search API returned {resp.status_code}")
+        return None
+    object_ids = resp.json().get("objectIDs") or []
+    _met_search_cache.set(key, object_ids)
+    return object_ids
+
+
+def _met_has_image(obj: Dict[str, Any]) -> bool:
+    return bool(obj.get("primaryImage") or obj.get("primaryImageSmall"))
+
+
+def _met_object_matches(obj: Dict[str, Any], search_terms: List[str]) -> bool:
+    """True if the object has an image, matches a search term and is by a woman artist."""
+    if not _met_has_image(obj):
+        return False
+
+    # Check keywords in tags, medium, classification, objectName, title
+    tags_text = " ".join(t.get("term", "") for t in (obj.get("tags") or []))
+    searchable = " ".join([
+        obj.get("title", ""),
+        obj.get("medium", ""),
+        obj.get("classification", ""),
+        obj.get("objectName", ""),
+        tags_text,
+    ]).lower()
+    if not any(term in searchable for term in search_terms):
+        return False
+
+    return _is_woman_artist(obj)
+
+
+def _is_woman_artist(obj: Dict[str, Any]) -> bool:
+    # Verify female: artistGender has any value OR name in curated list
+    artist_name = (obj.get("artistDisplayName") or "").lower().strip()
+    return bool(obj.get("artistGender")) or artist_name in _women_artist_names
+
+
+def _order_met_candidates(object_ids: List[int]) -> List[int]:
+    """
+    Order live-search candidates using what we already know about each object.
+
+    Curated and previously verified women-artist objects come first, unknown
+    objects follow, and objects already known to fail the artist check are
+    dropped. Each group is shuffled so repeated searches still vary.
+    """
+    verdicts = _met_artist_verdicts.get_many([str(oid) for oid in object_ids])
+    known_women, unknown = [], []
+    for oid in object_ids:
+        verdict = verdicts.get(str(oid))
+        if oid in _curated_object_ids or verdict:
+            known_women.append(oid)
+        elif verdict is None:
+            unknown.append(oid)
+    random.shuffle(known_women)
+    random.shuffle(unknown)
+    skipped = len(object_ids) - len(known_women) - len(unknown)
+    print(f"[met] Candidates: {len(known_women)} known women artists, {len(unknown)} unknown, {skipped} skipped")
+    return known_women + unknown
+
+
+def _met_cursor_state(q: str) -> Dict[str, Any]:
+    """Fresh search position: start of the curated stage (hardcoded + local index)."""
+    return {"q": " ".join(q.lower().split()), "stage": "curated", "offset": 0, "done": [], "plan": None}
+
+
+def _encode_met_cursor(state: Dict[str, Any]) -> str:
+    """Encode a continuation cursor, persisting a new live plan only now that one is handed out."""
+    state = dict(state)
+    plan_ids = state.pop("plan_ids", None)
+    if plan_ids is not None:
+        _met_search_cache.set(f"plan:{state['plan']}", plan_ids, ttl_seconds=MET_CURSOR_TTL)
+    raw = json.dumps(state, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_met_cursor(cursor: str, q: str) -> Dict[str, Any]:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if state["stage"] not in ("curated", "live") or state["q"] != _met_cursor_state(q)["q"]:
+            raise ValueError("cursor does not match query")
+        state["offset"] = int(state["offset"])
+        state["done"] = [int(i) for i in state["done"]]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if state["stage"] == "live" and state.get("plan"):
+        if _met_search_cache.get(f"plan:{state['plan']}") is None:
+            raise HTTPException(status_code=410, detail="Cursor expired, restart the search")
+    return state
+
+
+def _met_curated_ids(q: str) -> List[int]:
+    """Hardcoded keyword matches first, then local-index hits in BM25 order."""
+    ids = list(HARDCODED_KEYWORDS.get(q.strip().lower(), []))
+    seen = set(ids)
+    for item in _met_index.search(q, limit=len(_met_index.docs)):
+        oid = int(item["objectID"])
+        if oid not in seen:
+            seen.add(oid)
+            ids.append(oid)
+    return ids
+
+
+async def _iter_met_candidates(
+    client: httpx.AsyncClient,
+    object_ids: List[int],
+    state: Dict[str, Any],
+    matches,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield artworks for candidates that pass `matches`, as soon as each one qualifies.
+
+    Up to MET_LIVE_CONCURRENCY object fetches are kept in flight continuously
+    and checked in completion order, resuming from state["offset"] and skipping
+    indices in state["done"]. Progress is written back into `state` after every
+    completion. Closing the generator cancels every outstanding fetch.
+    """
+    offset = state["offset"]
+    done = set(state["done"])
+    semaphore = asyncio.Semaphore(MET_LIVE_CONCURRENCY)
+
+    async def fetch(index: int) -> tuple:
+        async with semaphore:
+            return index, await _fetch_met_object(client, object_ids[index])
+
+    tasks = [
+        asyncio.create_task(fetch(i))
+        for i in range(offset, len(object_ids)) if i not in done
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, obj = await next_done
+            done.add(index)
+            while offset in done:
+                done.discard(offset)
+                offset += 1
+            state["offset"], state["done"] = offset, sorted(done)
+            if obj and matches(obj):
+                artwork = _met_artwork(obj)
+                print(f"[met] ✓ {artwork['artist']} - {artwork['title']}")
+                yield artwork
+    finally:
+        cancelled = sum(1 for task in tasks if task.cancel())
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if cancelled:
+            print(f"[met] Cancelled {cancelled} outstanding object fetches")
+
+
+async def _iter_met_search(client: httpx.AsyncClient, q: str, state: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield artworks by women artists for a query, resuming from `state`.
+
+    The curated stage hydrates hardcoded and locally indexed objects (already
+    known to be by women). Once exhausted, the live stage searches the Met and
+    filters candidates. The live candidate order is kept in state["plan_ids"];
+    _encode_met_cursor saves it to the search cache only if a cursor is
+    handed out, so a later page can continue without redoing the search.
+    """
+    if state["stage"] == "curated":
+        curated_ids = _met_curated_ids(q)
+        print(f"[met] Curated candidates: {len(curated_ids)}")
+        async for artwork in _iter_met_candidates(client, curated_ids, state, _met_has_image):
+            yield artwork
+        state.update(stage="live", offset=0, done=[], plan=None)
+
+    if state["stage"] == "live":
+        if state["plan"]:
+            object_ids = _met_search_cache.get(f"plan:{state['plan']}") or []
+        else:
+            object_ids = await _fetch_met_search_ids(client, q)
+            if object_ids is None:
+                state["stage"] = "done"
+                return
+            print(f"[met] Found {len(object_ids)} total results")
+            curated = set(_met_curated_ids(q))
+            candidates = [oid for oid in object_ids if oid not in curated][:MET_VERDICT_LOOKUP_MAX]
+            # SQLite verdict lookup stays off the event loop
+            object_ids = await asyncio.to_thread(_order_met_candidates, candidates)
+            object_ids = object_ids[:MET_LIVE_MAX_FETCHES]
+            state["plan"], state["plan_ids"] = secrets.token_urlsafe(9), object_ids
+
+        search_terms = [t.lower() for t in q.split() if len(t) > 1]
+        async for artwork in _iter_met_candidates(
+            client, object_ids, state, lambda obj: _met_object_matches(obj, search_terms)
+        ):
+            yield artwork
+        state["stage"] = "done"
+
+
+# Warm in-memory results for HARDCODED_KEYWORDS, refreshed in the background
+MET_WARM_REFRESH_SECONDS = float(os.getenv("MET_WARM_REFRESH_SECONDS", str(6 * 3600)))
+# keyword -> {"results": [...], "ends": [...], "fetched_at": ts}; ends[i] is the curated
+# offset just past results[i], so a stream cursor can resume after any prefix
+_met_warm_cache: Dict[str, Dict[str, Any]] = {}
+_met_warm_refreshing: set = set()
+
+
+async def _refresh_hardcoded_artworks(keywords: List[str]) -> None:
+    """Refetch the hardcoded objects for each keyword, keeping old results on failure."""
+    keywords = [k for k in keywords if k not in _met_warm_refreshing]
+    _met_warm_refreshing.update(keywords)
+    try:
+        async with httpx.AsyncClient(timeout=30.0, headers=MET_HEADERS) as client:
+            for keyword in keywords:
+                objects = await asyncio.gather(
+                    *[_fetch_met_object(client, oid, refresh=True) for oid in HARDCODED_KEYWORDS[keyword]]
+                )
+                kept = [(i + 1, obj) for i, obj in enumerate(objects) if obj and _met_has_image(obj)]
+                if kept:
+                    _met_warm_cache[keyword] = {
+                        "results": [_met_artwork(obj) for _, obj in kept],
+                        "ends": [end for end, _ in kept],
+                        "fetched_at": time.time(),
+                    }
+    except Exception as e:
+        print(f"[met] Warm cache refresh failed: {e}")
+    finally:
+        _met_warm_refreshing.difference_update(keywords)
+
+
+async def _met_warm_cache_loop() -> None:
+    while True:
+        started = time.time()
+        await _refresh_hardcoded_artworks(list(HARDCODED_KEYWORDS))
+        print(f"[met] Warm cache refreshed {len(_met_warm_cache)} keywords in {time.time() - started:.1f}s")
+        await asyncio.sleep(MET_WARM_REFRESH_SECONDS)
+
+
+def _met_warm_entry(q: str) -> Optional[Dict[str, Any]]:
+    """Warm results for a hardcoded keyword; stale entries are still served but refresh in the background."""
+    keyword = q.strip().lower()
+    warm = _met_warm_cache.get(keyword)
+    if warm:
+        if time.time() - warm["fetched_at"] > MET_WARM_REFRESH_SECONDS and keyword not in _met_warm_refreshing:
+            _spawn_background(_refresh_hardcoded_artworks([keyword]))
+        print(f"[met] Warm cache hit for '{keyword}', {len(warm['results'])} artworks")
+    return warm
+
+
 @app.get("/api/met/women-artists")
 async def met_women_artists(q: str = Query(...)):
     """Search Met collection, return 8 artworks by women artists."""
     print(f"[met] Searching for: {q}")
-    query_lower = q.strip().lower()
-
-    # Check for hardcoded keyword match
-    hardcoded_ids = HARDCODED_KEYWORDS.get(query_lower)
-    if hardcoded_ids:
-        print(f"[met] Hardcoded match for '{query_lower}', fetching {len(hardcoded_ids)} objects")
-        met_headers = {"User-Agent": "SyntaxesiaApp/1.0"}
-        async with httpx.AsyncClient(timeout=30.0, headers=met_headers) as client:
-            tasks = [client.get(f"{MET_API_BASE}/objects/{oid}") for oid in hardcoded_ids]
-            responses = await asyncio.gather(*tasks, return_exceptions=True)
-            results = []
-            for r in responses:
-                if isinstance(r, Exception) or r.status_code != 200:
-                    continue
-                try:
-                    obj = r.json()
-                except Exception:
-                    continue
-                if not (obj.get("primaryImage") or obj.get("primaryImageSmall")):
-                    continue
-                results.append({
-                    "url": obj.get("primaryImage") or obj.get("primaryImageSmall"),
-                    "title": obj.get("title", "Untitled"),
-                    "artist": obj.get("artistDisplayName") or obj.get("culture") or "Unknown",
-                    "date": obj.get("objectDate", ""),
-                    "medium": obj.get("medium", ""),
-                    "department": obj.get("department", ""),
-                    "description": obj.get("creditLine") or obj.get("department", ""),
-                })
-                print(f"[met] ✓ {results[-1]['artist']} - {results[-1]['title']}")
-            print(f"[met] Done! Returning {len(results)} hardcoded artworks")
-            return results
-
-    # Fallback: live search for non-hardcoded keywords
-    search_terms = [t.lower() for t in q.split() if len(t) > 1]
-
-    met_headers = {"User-Agent": "SyntaxesiaApp/1.0"}
-    async with httpx.AsyncClient(timeout=30.0, headers=met_headers) as client:
-        resp = await client.get(f"{MET_API_BASE}/search", params={"q": q, "hasImages": "true"})
-        if resp.status_code != 200:
-            print(f"[met] Search API returned {resp.status_code}")
-            return []
-        data = resp.json()
-        object_ids = data.get("objectIDs") or []
-        print(f"[met] Found {len(object_ids)} total results")
-
-        if not object_ids:
-            return []
-
-        random.shuffle(object_ids)
-        results = []
-
-        for i in range(0, min(len(object_ids), 500), 10):
-            if len(results) >= 8:
-                break
 
-            batch = object_ids[i:i+10]
-            tasks = [client.get(f"{MET_API_BASE}/objects/{oid}") for oid in batch]
-            responses = await asyncio.gather(*tasks, return_exceptions=True)
+    # Hardcoded keywords are served from memory
+    warm = _met_warm_entry(q)
+    if warm:
+        return warm["results"]
 
-            for r in responses:
-                if len(results) >= 8:
+    results = []
+    async with httpx.AsyncClient(timeout=30.0, headers=MET_HEADERS) as client:
+        search = _iter_met_search(client, q, _met_cursor_state(q))
+        try:
+            async for artwork in search:
+                results.append(artwork)
+                if len(results) >= MET_RESULT_LIMIT:
                     break
-                if isinstance(r, Exception):
-                    continue
-                if r.status_code != 200:
-                    continue
-                try:
-                    obj = r.json()
-                except Exception:
-                    continue
-
-                if not (obj.get("primaryImage") or obj.get("primaryImageSmall")):
-                    continue
+        finally:
+            await search.aclose()
 
-                # Check keywords in tags, medium, classification, objectName, title
-                tags_text = " ".join(t.get("term", "") for t in (obj.get("tags") or []))
-                searchable = " ".join([
-                    obj.get("title", ""),
-                    obj.get("medium", ""),
-                    obj.get("classification", ""),
-                    obj.get("objectName", ""),
-                    tags_text,
-                ]).lower()
-                if not any(term in searchable for term in search_terms):
-                    continue
+    print(f"[met] Done! Returning {len(results)} artworks")
+    return results
 
-                # Verify female: artistGender has any value OR name in curated list
-                artist_name = (obj.get("artistDisplayName") or "").lower().strip()
-                is_woman = bool(obj.get("artistGender")) or artist_name in _women_artist_names
-                if not is_woman:
-                    continue
 
-                results.append({
-                    "url": obj.get("primaryImage") or obj.get("primaryImageSmall"),
-                    "title": obj.get("title", "Untitled"),
-                    "artist": obj.get("artistDisplayName") or obj.get("culture") or "Unknown",
-                    "date": obj.get("objectDate", ""),
-                    "medium": obj.get("medium", ""),
-                    "department": obj.get("department", ""),
-                    "description": obj.get("creditLine") or obj.get("department", ""),
-                })
-                print(f"[met] ✓ {results[-1]['artist']} - {results[-1]['title']}")
+@app.get("/api/met/women-artists/stream")
+async def met_women_artists_stream(
+    q: str = Query(...),
+    cursor: Optional[str] = None,
+    limit: int = Query(MET_RESULT_LIMIT, ge=1, le=50),
+):
+    """
+    NDJSON variant of the women-artists search.
 
-        print(f"[met] Done! Returning {len(results)} artworks")
-        return results
+    Emits one {"artwork": {...}} line per artwork as soon as it qualifies,
+    then a final {"cursor": ..., "count": n} line. Pass the cursor back to
+    continue past these results; it is null once the search is exhausted.
+    """
+    print(f"[met] Streaming search for: {q} (cursor={'yes' if cursor else 'no'})")
+    state = _decode_met_cursor(cursor, q) if cursor else _met_cursor_state(q)
+
+    # First page of a hardcoded keyword comes from memory; the cursor resumes
+    # the curated stage just past the hardcoded objects that were served
+    warm = None if cursor else _met_warm_entry(q)
+    if warm:
+        served = warm["results"][:limit]
+        if len(served) < len(warm["results"]):
+            state["offset"] = warm["ends"][len(served) - 1]
+        else:
+            state["offset"] = len(HARDCODED_KEYWORDS[q.strip().lower()])
+
+        async def warm_lines() -> AsyncIterator[str]:
+            for artwork in served:
+                yield json.dumps({"artwork": artwork}) + "\n"
+            yield json.dumps({"cursor": _encode_met_cursor(state), "count": len(served)}) + "\n"
+
+        return StreamingResponse(warm_lines(), media_type="application/x-ndjson")
+
+    async def lines() -> AsyncIterator[str]:
+        count = 0
+        async with httpx.AsyncClient(timeout=30.0, headers=MET_HEADERS) as client:
+            search = _iter_met_search(client, q, state)
+            try:
+                async for artwork in search:
+                    yield json.dumps({"artwork": artwork}) + "\n"
+                    count += 1
+                    if count >= limit:
+                        break
+            finally:
+                await search.aclose()
+        next_cursor = None if state["stage"] == "done" else _encode_met_cursor(state)
+        print(f"[met] Streamed {count} artworks")
+        yield json.dumps({"cursor": next_cursor, "count": count}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 # ============================================
@@ -405,106 +1230,403 @@ WILD_ACCENTS = [
 ]
 
 
+# One tokenizer pass feeds every keyword/identifier metric; one line pass feeds the rest.
+_CODE_TOKEN = re.compile(
+    r"\b(?P<decl>function|def)\s+(?P<name>[^\W\d]\w*)(?P<declcall>\s*\()?"
+    r"|\b(?P<elseif>else if)\b"
+    r"|\b(?P<kw>if|else|switch|case|match|for|while|do|try|catch|except|finally"
+    r"|map|filter|reduce|fold|compose|pipe|class|this|new|extends|public|private|protected"
+    r"|async|await|Promise)\b(?P<kwcall>\s*\()?"
+    r"|\b(?P<call>[^\W\d]\w*)\s*\("
+    r"|(?P<magic>(?<![.\w\[])(?:[2-9]|\d{2,})(?!\w))"
+    r"|(?P<arrow>=>)"
+    r"|\.(?P<then>then)\s*\("
+)
+# Walks the text line by line (MULTILINE) without splitting it into a list
+_CODE_LINE = re.compile(
+    r"^(?P<indent>[^\S\n]*)(?:"
+    r"(?P<unused>//[^\S\n]*(?:const|let|var|function|if|for|return|import))"
+    r"|(?P<comment>//|#|/\*|\* )"
+    r"|(?P<import>import[^\S\n]|const[^\S\n]+\w+[^\S\n]*=[^\S\n]*require\(|from[^\S\n]+['\"])"
+    r")?[^\n]*",
+    re.MULTILINE,
+)
+_WORD_METRIC = {
+    **dict.fromkeys(("if", "else", "switch", "case", "match"), "branch_count"),
+    **dict.fromkeys(("for", "while", "do"), "loop_count"),
+    **dict.fromkeys(("try", "catch", "except", "finally"), "try_catch_count"),
+    **dict.fromkeys(("map", "filter", "reduce", "fold", "compose", "pipe"), "functional_hints"),
+    **dict.fromkeys(("class", "this", "new", "extends", "public", "private", "protected"), "oop_hints"),
+    **dict.fromkeys(("async", "await", "Promise"), "async_count"),
+}
+_RECURSION_CANDIDATES = 12
+_DUPLICATE_BLOCK_LINES = 3
+_DUPLICATE_HASH_MOD = (1 << 61) - 1
+_DUPLICATE_HASH_BASE = 1_000_003
+_DUPLICATE_HASH_TOP = pow(_DUPLICATE_HASH_BASE, _DUPLICATE_BLOCK_LINES - 1, _DUPLICATE_HASH_MOD)
+
+
+def _scan_code(code: str) -> dict:
+    """Single tokenizer pass plus a single line pass; returns all raw counts."""
+    counts = dict.fromkeys(set(_WORD_METRIC.values()), 0)
+    counts["magic_numbers"] = 0
+    fn_names: Dict[str, List[str]] = {"function": [], "def": []}
+    calls: Dict[str, int] = {}
+
+    # Only tokens that feed a metric reach Python; the regex engine skips the rest
+    for tok in _CODE_TOKEN.finditer(code):
+        kind = tok.lastgroup
+        if kind == "kw" or kind == "kwcall":
+            word = tok.group("kw")
+            counts[_WORD_METRIC[word]] += 1
+            if kind == "kwcall":
+                calls[word] = calls.get(word, 0) + 1
+        elif kind == "call" or kind == "then":
+            word = tok.group(kind)
+            calls[word] = calls.get(word, 0) + 1
+            if kind == "then":
+                counts["async_count"] += 1
+        elif kind == "magic":
+            counts["magic_numbers"] += 1
+        elif kind == "arrow":
+            counts["functional_hints"] += 1
+        elif kind == "elseif":
+            counts["branch_count"] += 1
+        else:  # function/def declaration
+            word = tok.group("name")
+            fn_names[tok.group("decl")].append(word)
+            if word in _WORD_METRIC:
+                counts[_WORD_METRIC[word]] += 1
+            if kind == "declcall":
+                calls[word] = calls.get(word, 0) + 1
+
+    # Recursion: declared function names called 2+ times (the declaration counts)
+    candidates = (fn_names["function"] + fn_names["def"])[:_RECURSION_CANDIDATES]
+    counts["recursion_hints"] = sum(1 for name in candidates if calls.get(name, 0) >= 2)
+
+    non_empty = comment_lines = import_count = unused_code_lines = max_indent = 0
+    lines_of_code = 0
+    # Duplicate 3-line blocks: polynomial rolling hash over per-line hashes
+    window: deque = deque()  # (line_hash, stripped_length) for the last 3 lines
+    window_hash = window_chars = 0
+    window_counts: Dict[int, int] = {}
+    for line in _CODE_LINE.finditer(code):
+        lines_of_code += 1
+        stripped = line.group().strip()
+        line_hash = hash(stripped) % _DUPLICATE_HASH_MOD
+        if len(window) == _DUPLICATE_BLOCK_LINES:
+            old_hash, old_chars = window.popleft()
+            window_hash = (window_hash - old_hash * _DUPLICATE_HASH_TOP) % _DUPLICATE_HASH_MOD
+            window_chars -= old_chars
+        window.append((line_hash, len(stripped)))
+        window_hash = (window_hash * _DUPLICATE_HASH_BASE + line_hash) % _DUPLICATE_HASH_MOD
+        window_chars += len(stripped)
+        # Joined block longer than 10 chars (the two separators count)
+        if len(window) == _DUPLICATE_BLOCK_LINES and window_chars + _DUPLICATE_BLOCK_LINES - 1 > 10:
+            window_counts[window_hash] = window_counts.get(window_hash, 0) + 1
+
+        if line.group("import"):
+            import_count += 1
+        if not stripped:
+            continue  # blank line
+        non_empty += 1
+        if line.group("unused"):
+            unused_code_lines += 1
+        if line.group("comment") or line.group("unused"):
+            comment_lines += 1
+        indent = len(line.group("indent").replace("\t", "  ")) // 2
+        if indent > max_indent:
+            max_indent = indent
+
+    counts.update(
+        lines_of_code=lines_of_code,
+        comment_density=comment_lines / non_empty if non_empty else 0,
+        import_count=import_count,
+        unused_code_lines=unused_code_lines,
+        max_nesting_depth=max_indent,
+        duplicate_blocks=sum(1 for c in window_counts.values() if c > 1),
+    )
+    return counts
+
+
+# Same ceiling extract_important_files applies to repository files
+CODE_ANALYSIS_MAX_CHARS = 500_000
+
+
 def analyze_code(code: str):
-    lines = code.split("\n")
-    non_empty = [l for l in lines if l.strip()]
-    branch_count = len(re.findall(r"\b(if|else if|else|switch|case|match)\b", code))
-    loop_count = len(re.findall(r"\b(for|while|do)\b", code))
-    try_catch_count = len(re.findall(r"\b(try|catch|except|finally)\b", code))
-    comment_lines = sum(1 for l in non_empty if re.match(r"^\s*(//|#|/\*|\* )", l))
-    comment_density = comment_lines / len(non_empty) if non_empty else 0
-    functional_hints = len(re.findall(r"\b(map|filter|reduce|fold|compose|pipe)\b", code)) + len(re.findall(r"=>", code))
-    oop_hints = len(re.findall(r"\b(class|this|new|extends|public|private|protected)\b", code))
-    # Recursion: function names appearing 2+ times
-    fn_names = re.findall(r"\bfunction\s+([A-Za-z_]\w*)\b", code)
-    # Also check Python def
-    fn_names += re.findall(r"\bdef\s+([A-Za-z_]\w*)\b", code)
-    recursion_hints = 0
-    for name in fn_names[:12]:
-        hits = len(re.findall(rf"\b{re.escape(name)}\s*\(", code))
-        if hits >= 2:
-            recursion_hints += 1
-    return {
-        "branch_count": branch_count,
-        "loop_count": loop_count,
-        "try_catch_count": try_catch_count,
-        "comment_density": comment_density,
-        "functional_hints": functional_hints,
-        "oop_hints": oop_hints,
-        "recursion_hints": recursion_hints,
-    }
+    return _scan_code(code)
+
+
+_LANGUAGE_INDICATORS = {
+    "python": [r"\bdef\s+\w+\s*\(", r"\bimport\s+\w+", r"\bprint\s*\(", r":\s*\n\s+", r"\bself\b", r"\belif\b", r"\b__\w+__\b"],
+    "rust": [r"\bfn\s+\w+", r"\blet\s+mut\b", r"\bmatch\b", r"\bimpl\b", r"->", r"::", r"\bpub\s+(?:fn|struct|enum)", r"\bOption<", r"\bResult<"],
+    "java": [r"\bpublic\s+(?:static\s+)?void\b", r"\bSystem\.out", r"\bextends\b", r"\bimplements\b", r"\bpackage\s+", r"\b@Override\b"],
+    "typescript": [r":\s*(?:string|number|boolean|void)\b", r"\binterface\s+\w+", r"\b(?:type|enum)\s+\w+", r"<[A-Z]\w*>", r"\bas\s+\w+"],
+    "go": [r"\bfunc\s+\w+", r"\bpackage\s+main\b", r"\bfmt\.", r"\b:=\b", r"\bgo\s+func", r"\bchan\b"],
+    "c": [r"#include\s*<", r"\bprintf\s*\(", r"\bmalloc\s*\(", r"\bvoid\s+\w+\s*\(", r"\bsizeof\s*\(", r"\bNULL\b"],
+    "cpp": [r"\bstd::", r"#include\s*<(?:iostream|vector|string|memory)>", r"\btemplate\s*<", r"\bnamespace\s+\w+\s*\{", r"\bnullptr\b"],
+    "csharp": [r"\busing\s+System\b", r"\bnamespace\s+[\w.]+\s*;?", r"\bpublic\s+(?:async\s+)?Task\b", r"\bConsole\.Write", r"\bvar\s+\w+\s*=\s*new\b"],
+    "ruby": [r"\bputs\b", r"\brequire\s+['\"]", r"\bend\s*$", r"\bdo\s*\|", r"\battr_(?:accessor|reader)\b"],
+    "php": [r"<\?php", r"\$this->", r"\bfunction\s+\w+\s*\(\$", r"\becho\s+", r"\$\w+\s*="],
+    "kotlin": [r"\bfun\s+\w+", r"\bval\s+\w+", r"\bdata\s+class\b", r"\bcompanion\s+object\b", r"\bwhen\s*\("],
+    "swift": [r"\bguard\s+let\b", r"\bimport\s+(?:Foundation|UIKit|SwiftUI)\b", r"\bfunc\s+\w+\s*\(.*\)\s*->", r"\bvar\s+\w+\s*:\s*[A-Z]", r"@objc\b"],
+}
+# Each indicator compiled once and searched on its own: a combined alternation
+# reports only one pattern per position, so overlapping indicators (import
+# Foundation vs import \w+, #include <iostream> vs #include <) lose points
+_LANGUAGE_PATTERNS = {
+    lang: [re.compile(pattern, re.MULTILINE) for pattern in patterns]
+    for lang, patterns in _LANGUAGE_INDICATORS.items()
+}
+_JS_FALLBACK = re.compile(r"\b(const|let|var)\b|=>\s*[{(]")
+# Heuristics only look at the head of the file
+LANGUAGE_SNIFF_CHARS = 16_384
+
+_SHEBANG = re.compile(r"#!\s*(?:\S*/)?(?:env\s+(?:-\S+\s+)*)?([\w.+-]+)")
+_SHEBANG_LANGUAGES = {
+    "python": "python", "node": "javascript", "deno": "typescript", "ts-node": "typescript",
+    "bash": "shell", "sh": "shell", "zsh": "shell", "dash": "shell", "ksh": "shell",
+    "ruby": "ruby", "php": "php", "perl": "perl", "lua": "lua",
+}
 
 
 def detect_language(code: str) -> str:
-    indicators = {
-        "python": [r"\bdef\s+\w+\s*\(", r"\bimport\s+\w+", r"\bprint\s*\(", r":\s*\n\s+", r"\bself\b", r"\belif\b", r"\b__\w+__\b"],
-        "rust": [r"\bfn\s+\w+", r"\blet\s+mut\b", r"\bmatch\b", r"\bimpl\b", r"->", r"::", r"\bpub\s+(fn|struct|enum)", r"\bOption<", r"\bResult<"],
-        "java": [r"\bpublic\s+(static\s+)?void\b", r"\bSystem\.out", r"\bextends\b", r"\bimplements\b", r"\bpackage\s+", r"\b@Override\b"],
-        "typescript": [r":\s*(string|number|boolean|void)\b", r"\binterface\s+\w+", r"\b(type|enum)\s+\w+", r"<[A-Z]\w*>", r"\bas\s+\w+"],
-        "go": [r"\bfunc\s+\w+", r"\bpackage\s+main\b", r"\bfmt\.", r"\b:=\b", r"\bgo\s+func", r"\bchan\b"],
-        "c": [r"#include\s*<", r"\bprintf\s*\(", r"\bmalloc\s*\(", r"\bvoid\s+\w+\s*\(", r"\bsizeof\s*\(", r"\bNULL\b"],
-    }
+    """Score each language by how many of its indicators appear in the head of the file."""
+    prefix = code[:LANGUAGE_SNIFF_CHARS]
     best, best_score = "javascript", 0
-    for lang, patterns in indicators.items():
-        score = sum(1 for p in patterns if re.search(p, code))
+    for lang, patterns in _LANGUAGE_PATTERNS.items():
+        score = sum(1 for pattern in patterns if pattern.search(prefix))
         if score > best_score:
-            best_score = score
-            best = lang
-    if best_score < 2:
-        if re.search(r"\b(const|let|var)\b", code) or re.search(r"=>\s*[{(]", code):
-            return "javascript"
+            best, best_score = lang, score
+    if best_score < 2 and _JS_FALLBACK.search(prefix):
+        return "javascript"
     return best
 
 
-def compute_metrics(code: str, language: str, signals: dict) -> dict:
-    lines = code.split("\n")
-    import_count = sum(1 for l in lines if re.match(r"^\s*(import\s|const\s+\w+\s*=\s*require\(|from\s+['\"])", l))
-    async_count = len(re.findall(r"\basync\b|\bawait\b|\bPromise\b|\.then\s*\(", code))
-    magic_numbers = len(re.findall(r"(?<![.\w\[])(?:[2-9]|\d{2,})(?!\w)", code))
-    max_indent = 0
-    for line in lines:
-        if not line.strip():
-            continue
-        m = re.match(r"^(\s*)", line)
-        spaces = len(m.group(1).replace("\t", "  ")) if m else 0
-        indent = spaces // 2
-        if indent > max_indent:
-            max_indent = indent
-    # Duplicate 3-line blocks
-    block_map = {}
-    for i in range(len(lines) - 2):
-        block = "\n".join(l.strip() for l in lines[i:i+3])
-        if len(block) > 10:
-            block_map[block] = block_map.get(block, 0) + 1
-    duplicate_blocks = sum(1 for c in block_map.values() if c > 1)
-    unused_code_lines = sum(1 for l in lines if re.match(r"^\s*//\s*(const|let|var|function|if|for|return|import)", l))
+def _shebang_language(code: str) -> Optional[str]:
+    if not code.startswith("#!"):
+        return None
+    m = _SHEBANG.match(code[:200])
+    if not m:
+        return None
+    interpreter = m.group(1).lower()
+    return _SHEBANG_LANGUAGES.get(interpreter.rstrip("0123456789.")) or _SHEBANG_LANGUAGES.get(interpreter)
+
+
+def resolve_language(code: str, path: Optional[str] = None, language: Optional[str] = None) -> str:
+    """Explicit language, then file extension, then shebang, then content heuristics."""
+    if language:
+        return language
+    if path:
+        ext = os.path.splitext(path)[1].lower()
+        if ext in EXTENSION_LANGUAGES:
+            return EXTENSION_LANGUAGES[ext]
+    return _shebang_language(code) or detect_language(code)
 
+
+def compute_metrics(code: str, language: str, signals: dict) -> dict:
     return {
         "language": language,
         "recursion_count": signals["recursion_hints"],
         "loop_count": signals["loop_count"],
         "conditional_count": signals["branch_count"],
         "class_count": signals["oop_hints"] // 3,
-        "async_count": async_count,
+        "async_count": signals["async_count"],
         "functions": signals["functional_hints"],
         "cyclomatic_complexity": signals["branch_count"] + signals["loop_count"] + 1,
-        "import_count": import_count,
-        "lines_of_code": len(lines),
-        "max_nesting_depth": max_indent,
+        "import_count": signals["import_count"],
+        "lines_of_code": signals["lines_of_code"],
+        "max_nesting_depth": signals["max_nesting_depth"],
         "try_catch_count": signals["try_catch_count"],
-        "unused_code_lines": unused_code_lines,
+        "unused_code_lines": signals["unused_code_lines"],
         "comment_ratio": signals["comment_density"],
-        "duplicate_blocks": duplicate_blocks,
-        "magic_numbers": magic_numbers,
+        "duplicate_blocks": signals["duplicate_blocks"],
+        "magic_numbers": signals["magic_numbers"],
     }
 
 
-def get_element_color_palette(m: dict) -> str:
+# ============================================
+# Repository-relative Metrics
+# ============================================
+
+# Numeric compute_metrics fields, in matrix column order ("chaos" is derived)
+REPO_METRIC_KEYS = [
+    "recursion_count", "loop_count", "conditional_count", "class_count", "async_count",
+    "functions", "cyclomatic_complexity", "import_count", "lines_of_code",
+    "max_nesting_depth", "try_catch_count", "unused_code_lines", "comment_ratio",
+    "duplicate_blocks", "magic_numbers",
+]
+REPO_PERCENTILES = [25, 50, 75, 90]
+# Fewer files than this and "relative to the repo" means little; keep absolute thresholds
+REPO_RELATIVE_MIN_FILES = 3
+
+
+def _chaos_score(m: dict) -> float:
+    return m["cyclomatic_complexity"] + m["max_nesting_depth"] * 2 + m["loop_count"]
+
+
+class RepoMetricProfile:
+    """
+    compute_metrics vectors for every file of a repo as one matrix.
+
+    Column statistics, per-file z-scores and per-file percentile ranks are
+    computed in a single vectorized step so prompts can describe a file
+    relative to its siblings rather than against fixed thresholds.
+    """
+
+    def __init__(self, metrics: List[dict]):
+        self.keys = REPO_METRIC_KEYS + ["chaos"]
+        self.matrix = np.array(
+            [[float(m[k]) for k in REPO_METRIC_KEYS] + [_chaos_score(m)] for m in metrics],
+            dtype=np.float64,
+        ).reshape(len(metrics), len(self.keys))
+        n = self.matrix.shape[0]
+        self.mean = self.matrix.mean(axis=0) if n else np.zeros(len(self.keys))
+        self.std = self.matrix.std(axis=0) if n else np.zeros(len(self.keys))
+        self.zscores = np.divide(
+            self.matrix - self.mean, self.std,
+            out=np.zeros_like(self.matrix), where=self.std > 0,
+        )
+        # Percentile rank among the other files: share strictly below plus half the ties
+        below = (self.matrix[:, None, :] > self.matrix[None, :, :]).sum(axis=1)
+        ties = (self.matrix[:, None, :] == self.matrix[None, :, :]).sum(axis=1) - 1
+        self.percentiles = (below + 0.5 * ties) / max(n - 1, 1)
+        self.quantiles = (
+            np.percentile(self.matrix, REPO_PERCENTILES, axis=0)
+            if n else np.zeros((len(REPO_PERCENTILES), len(self.keys)))
+        )
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def relative(self, index: int) -> Optional[dict]:
+        """Percentile ranks and z-scores for one file, or None for tiny repos."""
+        if len(self) < REPO_RELATIVE_MIN_FILES:
+            return None
+        return {
+            "percentile": {k: round(float(v), 4) for k, v in zip(self.keys, self.percentiles[index])},
+            "zscore": {k: round(float(v), 4) for k, v in zip(self.keys, self.zscores[index])},
+        }
+
+    def summary(self) -> dict:
+        return {
+            "files": len(self),
+            **{
+                key: {
+                    "mean": round(float(self.mean[j]), 4),
+                    "std": round(float(self.std[j]), 4),
+                    **{f"p{p}": round(float(self.quantiles[i][j]), 4) for i, p in enumerate(REPO_PERCENTILES)},
+                }
+                for j, key in enumerate(self.keys)
+            },
+        }
+
+
+# ============================================
+# CPU-bound Analysis Offload
+# ============================================
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(min(4, os.cpu_count() or 1))))
+ANALYSIS_QUEUE_LIMIT = int(os.getenv("ANALYSIS_QUEUE_LIMIT", str(max(1, ANALYSIS_WORKERS) * 4)))
+# Below this many characters the work is cheaper than a round trip to a worker
+ANALYSIS_INLINE_MAX_CHARS = int(os.getenv("ANALYSIS_INLINE_MAX_CHARS", "8192"))
+
+
+def _warm_analysis_worker() -> int:
+    return os.getpid()
+
+
+class AnalysisPool:
+    """
+    Process pool for regex-heavy analysis so big inputs don't stall the event loop.
+
+    Small inputs run inline; larger ones wait for one of queue_limit slots and
+    then run on a warm worker process.
+    """
+
+    def __init__(self, workers: int, queue_limit: int, inline_max_chars: int):
+        self.workers = workers
+        self.inline_max_chars = inline_max_chars
+        self._slots = asyncio.Semaphore(queue_limit)
+        self.queue_limit = queue_limit
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.inline_runs = 0
+        self.offloaded_runs = 0
+        self.queued = 0
+
+    def start(self, mp_context=None) -> None:
+        if self.workers <= 0:
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context)
+        # One no-op per worker spawns them all now instead of on the first big request
+        for _ in range(self.workers):
+            self._executor.submit(_warm_analysis_worker)
+        print(f"[analysis] Started {self.workers} worker processes (queue limit {self.queue_limit})")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def runs_inline(self, size: int) -> bool:
+        return self._executor is None or size < self.inline_max_chars
+
+    async def run(self, fn, *args, size: int):
+        """Run fn(*args), offloading to a worker process when size is large enough."""
+        if self.runs_inline(size):
+            self.inline_runs += 1
+            return fn(*args)
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        try:
+            self.offloaded_runs += 1
+            executor = self._executor
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            print("[analysis] Worker pool broke, restarting it")
+            if self._executor is executor:
+                self.shutdown()
+                # Threads are running by now, so forking this process is unsafe;
+                # replacement workers come from a clean forkserver instead
+                self.start(multiprocessing.get_context("forkserver"))
+            return await asyncio.to_thread(fn, *args)
+        finally:
+            self._slots.release()
+
+    def offload_from_thread(self, loop: asyncio.AbstractEventLoop):
+        """Callable for synchronous code running in a thread (e.g. GitHubExtractor)."""
+        def offload(fn, *args, size: int = 0):
+            if self.runs_inline(size):
+                self.inline_runs += 1
+                return fn(*args)
+            return asyncio.run_coroutine_threadsafe(self.run(fn, *args, size=size), loop).result()
+        return offload
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers if self._executor is not None else 0,
+            "queue_limit": self.queue_limit,
+            "queued": self.queued,
+            "inline_runs": self.inline_runs,
+            "offloaded_runs": self.offloaded_runs,
+        }
+
+
+_analysis_pool = AnalysisPool(ANALYSIS_WORKERS, ANALYSIS_QUEUE_LIMIT, ANALYSIS_INLINE_MAX_CHARS)
+
+
+def get_element_color_palette(m: dict, rng=random) -> str:
     active = []
     for ec in ELEMENT_COLORS:
         val = m.get(ec["key"], 0)
         if val > 0:
-            active.append({"name": ec["name"], "hex": ec["hex"], "weight": min(val, 10)})
+            pct = m.get("repo_relative", {}).get("percentile", {}).get(ec["key"])
+            # Relative to the repo when known: a file's most unusual elements dominate
+            weight = 1 + round(9 * pct) if pct is not None else min(val, 10)
+            active.append({"name": ec["name"], "hex": ec["hex"], "weight": weight})
     if len(active) < 2:
         active += [
             {"name": "ivory black", "hex": "#1b1b1b", "weight": 5},
@@ -512,7 +1634,7 @@ def get_element_color_palette(m: dict) -> str:
             {"name": "cadmium red", "hex": "#e21a1a", "weight": 2},
         ]
     shuffled = WILD_ACCENTS[:]
-    random.shuffle(shuffled)
+    rng.shuffle(shuffled)
     num_accents = min(5, len(shuffled))  # More wild accents = more auction value
     active.sort(key=lambda c: c["weight"], reverse=True)
     primary = ", ".join(f'{c["name"]} — DOMINANT' for c in active[:3])
@@ -536,6 +1658,15 @@ def get_density_directive(loc: int) -> str:
     return "COMPLEX INTERMEDIA: 70% coverage with intense detail. Camp irony - looks expensive and laborious."
 
 
+def _chaos_tier(m: dict, high: float, mid: float) -> int:
+    """2/1/0 for high/mid/low chaos: repo percentile when known, else absolute thresholds."""
+    pct = m.get("repo_relative", {}).get("percentile", {}).get("chaos")
+    if pct is not None:
+        return 2 if pct >= 0.8 else 1 if pct >= 0.5 else 0
+    chaos = _chaos_score(m)
+    return 2 if chaos > high else 1 if chaos > mid else 0
+
+
 def get_extremity_directive(m: dict) -> str:
     chaos = m["cyclomatic_complexity"] + m["max_nesting_depth"] * 2 + m["loop_count"]
     if chaos > 25:
@@ -545,20 +1676,40 @@ def get_extremity_directive(m: dict) -> str:
     return "CONCEPTUALIST IRONY meets KITSCH: Seemingly controlled but unsettlingly ornate. Camp aesthetic."
 
 
+# Metric -> (absolute threshold, medium), in priority order
+ART_MEDIUMS = {
+    "recursion_count": (3, "MEDIUM: Layered cut paper collage with visible depth. Thick cardboard and foam shapes stacked 3-5 layers deep. Think Elizabeth Murray or Keith Haring foam reliefs."),
+    "loop_count": (8, "MEDIUM: Obsessive hand-stitched textile. Thousands of identical small elements in a dense grid. Think Sheila Hicks fiber art or El Anatsui bottle cap tapestries."),
+    "conditional_count": (10, "MEDIUM: Architectural drawing on translucent vellum. Precise ink lines, layered tracing paper. Think Julie Mehretu or Mark Lombardi network drawings."),
+    "class_count": (3, "MEDIUM: Welded steel and found metal assemblage. Heavy industrial pieces welded together. Think Anthony Caro or John Chamberlain crushed car sculptures."),
+    "async_count": (5, "MEDIUM: Hanging installation of disparate objects suspended by thin wires. Think Sarah Sze or Mike Kelley hanging pieces."),
+}
+COLOR_FIELD_MEDIUM = "MEDIUM: Large-scale color field painting. 2-3 massive soft-edged rectangles of luminous color. Think Mark Rothko or Helen Frankenthaler stain paintings."
+COLLAGE_MEDIUM = "MEDIUM: Mixed-media collage combining torn paper, paint strokes, fabric scraps. Think Robert Rauschenberg combines or Kurt Schwitters Merzbau."
+# Percentile rank at which a file "stands out" from its repo on a metric
+RELATIVE_STANDOUT_PERCENTILE = 0.75
+
+
 def get_art_medium(m: dict) -> str:
-    if m["recursion_count"] > 3:
-        return "MEDIUM: Layered cut paper collage with visible depth. Thick cardboard and foam shapes stacked 3-5 layers deep. Think Elizabeth Murray or Keith Haring foam reliefs."
-    if m["loop_count"] > 8:
-        return "MEDIUM: Obsessive hand-stitched textile. Thousands of identical small elements in a dense grid. Think Sheila Hicks fiber art or El Anatsui bottle cap tapestries."
-    if m["conditional_count"] > 10:
-        return "MEDIUM: Architectural drawing on translucent vellum. Precise ink lines, layered tracing paper. Think Julie Mehretu or Mark Lombardi network drawings."
-    if m["class_count"] > 3:
-        return "MEDIUM: Welded steel and found metal assemblage. Heavy industrial pieces welded together. Think Anthony Caro or John Chamberlain crushed car sculptures."
-    if m["async_count"] > 5:
-        return "MEDIUM: Hanging installation of disparate objects suspended by thin wires. Think Sarah Sze or Mike Kelley hanging pieces."
+    relative = m.get("repo_relative")
+    if relative:
+        # The metric where this file ranks highest among its siblings picks the medium
+        present = [k for k in ART_MEDIUMS if m[k] > 0]
+        if present:
+            key = max(present, key=lambda k: (relative["percentile"][k], relative["zscore"][k]))
+            if relative["percentile"][key] >= RELATIVE_STANDOUT_PERCENTILE:
+                return ART_MEDIUMS[key][1]
+        pct = relative["percentile"]
+        if pct["cyclomatic_complexity"] <= 0.25 and pct["functions"] <= 0.25:
+            return COLOR_FIELD_MEDIUM
+        return COLLAGE_MEDIUM
+
+    for key, (threshold, medium) in ART_MEDIUMS.items():
+        if m[key] > threshold:
+            return medium
     if m["cyclomatic_complexity"] < 5 and m["functions"] < 5:
-        return "MEDIUM: Large-scale color field painting. 2-3 massive soft-edged rectangles of luminous color. Think Mark Rothko or Helen Frankenthaler stain paintings."
-    return "MEDIUM: Mixed-media collage combining torn paper, paint strokes, fabric scraps. Think Robert Rauschenberg combines or Kurt Schwitters Merzbau."
+        return COLOR_FIELD_MEDIUM
+    return COLLAGE_MEDIUM
 
 
 def get_texture_overlays(m: dict) -> str:
@@ -576,14 +1727,14 @@ def get_texture_overlays(m: dict) -> str:
     return "\n".join(overlays) if overlays else "Dense painted marks covering the entire canvas."
 
 
-def generate_gallery_prompt(m: dict) -> str:
+def generate_gallery_prompt(m: dict, rng=random) -> str:
     return f"""A post-modern abstract artwork covering the entire image edge to edge. 8K hyper-detailed.
 The artwork extends beyond all four edges — as if cropped from a larger piece. Every pixel is art.
 
 {get_art_medium(m)}
 
 COLOR PALETTE:
-{get_element_color_palette(m)}
+{get_element_color_palette(m, rng)}
 
 {get_texture_overlays(m)}
 
@@ -596,7 +1747,7 @@ NO borders, NO surrounding space, NO walls, NO floor, NO mat.
 Strictly abstract. Square format. 100% surface coverage."""
 
 
-def generate_dalle_prompt(m: dict) -> str:
+def generate_dalle_prompt(m: dict, rng=random) -> str:
     # ANTI-MINIMALIST movement selection - lower thresholds for complexity
     if m["recursion_count"] > 1:
         movement = "CYBERNETIC RECURSION × SPIRAL JETTY EARTHWORKS: Fractal self-similarity with Land Art entropy (Escher × Smithson)"
@@ -611,224 +1762,633 @@ def generate_dalle_prompt(m: dict) -> str:
     else:
         movement = "POST-STRUCTURALIST PASTICHE × INSTITUTIONAL CRITIQUE: Multi-layered semantic collision (Rauschenberg × Jenny Holzer)"
 
-    chaos = m["cyclomatic_complexity"] + m["max_nesting_depth"] * 2 + m["loop_count"]
-    if chaos > 15:
-        marks = "VIOLENT MAXIMALISM: Explosive brushwork, splattered day-glo paint, aggressive gestural painting"
-    elif chaos > 8:
-        marks = "NEO-EXPRESSIONIST ENERGY: Bold painted strokes, dripping paint, thick impasto, raw canvas"
-    else:
-        marks = "CAMP IRONY: Over-painted decoration, obsessive painted patterns, maximalist surface"
+    tier = _chaos_tier(m, 15, 8)
+    if tier == 2:
+        marks = "VIOLENT MAXIMALISM: Explosive brushwork, splattered day-glo paint, aggressive gestural painting"
+    elif tier == 1:
+        marks = "NEO-EXPRESSIONIST ENERGY: Bold painted strokes, dripping paint, thick impasto, raw canvas"
+    else:
+        marks = "CAMP IRONY: Over-painted decoration, obsessive painted patterns, maximalist surface"
+
+    return f"""A 2D PAINTING on canvas. 8K hyper-detailed. The painting covers the entire image edge to edge.
+Style: {movement}
+
+{get_density_directive(m["lines_of_code"])}
+COMPOSITION: Flatbed picture plane (no horizon, no depth). Pure FLAT painted surface.
+
+PAINTED COLOR PALETTE:
+{get_element_color_palette(m, rng)}
+
+PAINTING TECHNIQUE & SURFACE:
+{get_texture_overlays(m)}
+MEDIUM: Acrylic paint, oil paint, spray paint, ink on canvas. Purely 2D painted surface.
+Visible painted texture - thick impasto, thin washes, drips, splatters, brushstrokes.
+
+MARK-MAKING: {marks}
+
+SURFACE: Painted marks only - NO objects. Colors suggest depth through layering and texture.
+Thick paint application, matte/glossy contrasts, visible brushwork evidence.
+Gothic-Baroque-Pop fusion - ornate painted patterns meets flat color fields.
+This took months of painting. Masterful 2D craftsmanship.
+
+CRITICAL: 100% ABSTRACT 2D PAINTING on canvas. NO objects, text, numbers, faces, depth.
+Pure painted abstract marks. Flat surface covered edge-to-edge with dense painted detail.
+NO borders, NO surrounding space, NO walls, NO floor, NO mat. Art bleeds past every edge."""
+
+
+# Image backend pool: every Vertex AI project/region and Gemini API key is one
+# backend. Backends are numbered 1, 2, 3, ... through suffixed env vars
+# (GCP_PROJECT_ID, GCP_PROJECT_ID_2, ...; GEMINI_API_KEY, GEMINI_API_KEY_2, ...),
+# so adding quota is a config change.
+IMAGE_BACKEND_MAX_INDEX = 32
+VERTEX_MODEL = "imagen-3.0-generate-002"
+GEMINI_MODEL = "imagen-4.0-generate-001"
+
+# Circuit breakers: a throttled backend is skipped for a cooldown that doubles
+# on repeated trips; other errors trip it after several consecutive failures.
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("IMAGE_BREAKER_COOLDOWN", "15"))
+BREAKER_MAX_COOLDOWN_SECONDS = 120.0
+# Hedging: if the primary has not answered within its p95 latency, the prompt
+# is also sent to a second backend. Until enough samples exist, use a default.
+HEDGE_MIN_SAMPLES = 10
+HEDGE_DEFAULT_SECONDS = float(os.getenv("IMAGE_HEDGE_DEFAULT_SECONDS", "25"))
+# Vertex access tokens are refreshed in the background this long before expiry
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+# Overall budget for one prompt, including waits for throttled backends
+IMAGE_GENERATE_DEADLINE_SECONDS = float(os.getenv("IMAGE_GENERATE_DEADLINE", "150"))
+
+
+def _env_suffixed(name: str, index: int, default: str = "") -> str:
+    key = name if index == 1 else f"{name}_{index}"
+    return os.getenv(key, default).strip()
+
+
+def _load_vertex_credentials(index: int):
+    """Load service account credentials for Vertex backend `index`, or None."""
+    scopes = ["https://www.googleapis.com/auth/cloud-platform"]
+    suffix = "" if index == 1 else f"_{index}"
+
+    # Try loading credentials from JSON string (for Vercel/production)
+    creds_json = _env_suffixed("GOOGLE_APPLICATION_CREDENTIALS_JSON", index)
+    if creds_json:
+        try:
+            from google.oauth2 import service_account
+            credentials = service_account.Credentials.from_service_account_info(json.loads(creds_json), scopes=scopes)
+            print(f"[startup] Vertex AI #{index} credentials loaded from GOOGLE_APPLICATION_CREDENTIALS_JSON{suffix} env var")
+            return credentials
+        except Exception as e:
+            print(f"[startup] Failed to load Vertex AI #{index} credentials from JSON: {e}")
+            return None
+
+    # Fallback to file path (for local development)
+    key_path = _env_suffixed("GOOGLE_APPLICATION_CREDENTIALS", index)
+    if key_path and os.path.exists(key_path):
+        from google.oauth2 import service_account
+        credentials = service_account.Credentials.from_service_account_file(key_path, scopes=scopes)
+        print(f"[startup] Vertex AI #{index} credentials loaded from {key_path}")
+        return credentials
+    return None
+
+
+class ImageBackendThrottled(Exception):
+    """Raised when a backend answers 429; carries the Retry-After hint if any."""
+
+    def __init__(self, retry_after: Optional[float] = None):
+        super().__init__("throttled")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Per-backend breaker: closed -> open (skipped) -> half-open (one probe) -> closed.
+
+    A 429 opens the breaker immediately; other failures open it after
+    BREAKER_FAILURE_THRESHOLD in a row. Each re-trip doubles the cooldown.
+    """
+
+    def __init__(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.cooldown = BREAKER_COOLDOWN_SECONDS
+        self.open_until = 0.0
+        self.probe_in_flight = False
+
+    def available(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() >= self.open_until
+        return not self.probe_in_flight
+
+    def on_dispatch(self) -> None:
+        if self.state == "open" and time.monotonic() >= self.open_until:
+            self.state = "half_open"
+        if self.state == "half_open":
+            self.probe_in_flight = True
+
+    def on_cancel(self) -> None:
+        self.probe_in_flight = False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.cooldown = BREAKER_COOLDOWN_SECONDS
+        self.probe_in_flight = False
+
+    def record_failure(self, throttled: bool = False, retry_after: Optional[float] = None) -> None:
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if throttled or self.state == "half_open" or self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+            if self.state != "closed":
+                self.cooldown = min(self.cooldown * 2, BREAKER_MAX_COOLDOWN_SECONDS)
+            self.state = "open"
+            self.open_until = time.monotonic() + max(self.cooldown, retry_after or 0)
+
+
+class ImageBackend:
+    """One Imagen endpoint in the pool: a Vertex AI project/region or a Gemini API key."""
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        weight: float,
+        max_concurrency: int,
+        tier: int,
+        credentials=None,
+        api_key: Optional[str] = None,
+    ):
+        self.name = name
+        self.url = url
+        self.weight = max(weight, 0.01)
+        self.max_concurrency = max_concurrency
+        # Lower tiers are preferred; higher tiers are only tried after they fail
+        self.tier = tier
+        self.credentials = credentials
+        self.api_key = api_key
+        self.in_flight = 0
+        self.total_requests = 0
+        self.breaker = CircuitBreaker()
+        self.latencies: deque = deque(maxlen=100)
+        self._token_lock = asyncio.Lock()
+        self.token_refreshes = 0
+        self.token_refresh_failures = 0
+        self.token_refresh_last_seconds: Optional[float] = None
+        self.token_refresh_last_error: Optional[str] = None
+
+    @property
+    def load(self) -> float:
+        return self.in_flight / self.weight
+
+    @property
+    def has_capacity(self) -> bool:
+        return self.max_concurrency <= 0 or self.in_flight < self.max_concurrency
+
+    def latency_p95(self) -> Optional[float]:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def token_seconds_left(self) -> float:
+        """Seconds until the cached Vertex token expires (0 if there is none)."""
+        if not self.credentials.token or not self.credentials.expiry:
+            return 0.0
+        now = datetime.now(timezone.utc).replace(tzinfo=None)  # google-auth expiry is naive UTC
+        return max((self.credentials.expiry - now).total_seconds(), 0.0)
+
+    async def refresh_token(self) -> None:
+        """Refresh the Vertex token in a worker thread so the event loop never blocks."""
+        import google.auth.transport.requests as google_requests
+        async with self._token_lock:
+            if self.token_seconds_left() > TOKEN_REFRESH_MARGIN_SECONDS:
+                return  # another caller refreshed while we waited
+            started = time.monotonic()
+            try:
+                await asyncio.to_thread(self.credentials.refresh, google_requests.Request())
+            except Exception as e:
+                self.token_refresh_failures += 1
+                self.token_refresh_last_error = str(e)[:200]
+                print(f"[generate] {self.name} token refresh failed: {e}")
+                raise
+            finally:
+                self.token_refresh_last_seconds = round(time.monotonic() - started, 3)
+            self.token_refreshes += 1
+            self.token_refresh_last_error = None
+
+    async def auth_headers(self) -> Dict[str, str]:
+        if self.api_key:
+            return {"x-goog-api-key": self.api_key, "Content-Type": "application/json"}
+        # Normally the background loop keeps the token fresh; refresh inline only if it lapsed
+        if self.token_seconds_left() <= 0:
+            await self.refresh_token()
+        return {"Authorization": f"Bearer {self.credentials.token}", "Content-Type": "application/json"}
+
+    async def generate(self, prompt: str) -> Optional[str]:
+        """
+        Make one request, returning base64 PNG data, or None if the prompt was rejected.
+
+        Raises ImageBackendThrottled on 429, and lets network failures and 5xx
+        errors propagate, so the pool can route around this backend.
+        """
+        body = {"instances": [{"prompt": prompt}], "parameters": {"sampleCount": 1, "aspectRatio": "1:1"}}
+        headers = await self.auth_headers()
+        timeout = httpx.Timeout(90.0, connect=10.0)
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            response = await client.post(self.url, headers=headers, json=body)
+        if response.status_code == 429:
+            retry_after = response.headers.get("retry-after", "")
+            raise ImageBackendThrottled(float(retry_after) if retry_after.isdigit() else None)
+        if response.status_code >= 500:
+            raise RuntimeError(f"{self.name} error {response.status_code}: {response.text[:300]}")
+        if response.status_code >= 400:
+            print(f"[generate] {self.name} error {response.status_code}: {response.text[:300]}")
+            return None
+        predictions = response.json().get("predictions", [])
+        return predictions[0].get("bytesBase64Encoded") if predictions else None
+
+
+# Progress events for the request currently generating (set by /api/generate/stream)
+_generation_events: ContextVar = ContextVar("generation_events", default=None)
+
+
+def _emit_generation_event(event: str, **data) -> None:
+    queue = _generation_events.get()
+    if queue is not None:
+        queue.put_nowait((event, data))
+
+
+class ImageBackendPool:
+    """
+    Routes each prompt to the least-loaded healthy backend with free capacity.
+
+    Load is in-flight requests divided by weight. Backends whose circuit
+    breaker is open are skipped; among the rest, the lowest tier not yet tried
+    for this prompt wins. If the chosen backend has not answered within its
+    p95 latency, the prompt is hedged to a second backend and the first
+    result wins. When every backend is throttled the prompt waits for the
+    earliest breaker to reopen, within IMAGE_GENERATE_DEADLINE_SECONDS.
+    """
+
+    def __init__(self, backends: List[ImageBackend]):
+        self.backends = backends
+        self._slot_freed = asyncio.Condition()
+        self._waiters: List[object] = []  # FIFO of requests waiting for a slot
+
+    def _pick(self, tried: set) -> tuple:
+        """Return (backend, should_wait) for the best untried healthy backend."""
+        healthy = [b for b in self.backends if b.name not in tried and b.breaker.available()]
+        if not healthy:
+            return None, False
+        tier = min(b.tier for b in healthy)
+        available = [b for b in healthy if b.tier == tier and b.has_capacity]
+        if not available:
+            return None, True
+        return min(available, key=lambda b: (b.load, b.total_requests)), False
+
+    def _claim(self, backend: ImageBackend) -> ImageBackend:
+        backend.in_flight += 1
+        backend.total_requests += 1
+        backend.breaker.on_dispatch()
+        return backend
+
+    async def _acquire(self, tried: set, wait: bool = True) -> Optional[ImageBackend]:
+        waiter = object()
+        position = None
+        async with self._slot_freed:
+            try:
+                while True:
+                    backend, should_wait = self._pick(tried)
+                    if backend is not None:
+                        return self._claim(backend)
+                    if not (should_wait and wait):
+                        return None
+                    if waiter not in self._waiters:
+                        self._waiters.append(waiter)
+                    if self._waiters.index(waiter) != position:
+                        position = self._waiters.index(waiter)
+                        _emit_generation_event("queued", position=position + 1)
+                    await self._slot_freed.wait()
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    async def _release(self, backend: ImageBackend) -> None:
+        async with self._slot_freed:
+            backend.in_flight -= 1
+            self._slot_freed.notify_all()
+
+    async def _attempt(self, backend: ImageBackend, prompt: str) -> Optional[str]:
+        """One request on a claimed backend, feeding its breaker and latency samples."""
+        started = time.monotonic()
+        print(f"[generate] → {backend.name} (in flight {backend.in_flight}, request #{backend.total_requests})")
+        _emit_generation_event("backend", backend=backend.name, in_flight=backend.in_flight)
+        try:
+            result = await backend.generate(prompt)
+        except asyncio.CancelledError:
+            backend.breaker.on_cancel()
+            raise
+        except ImageBackendThrottled as e:
+            backend.breaker.record_failure(throttled=True, retry_after=e.retry_after)
+            cooldown = backend.breaker.open_until - time.monotonic()
+            print(f"[generate] {backend.name} 429 — circuit open for {cooldown:.0f}s")
+            _emit_generation_event("throttled", backend=backend.name, cooldown_seconds=round(cooldown))
+            return None
+        except Exception as e:
+            backend.breaker.record_failure()
+            print(f"[generate] {backend.name} failed: {e}")
+            _emit_generation_event("backend_error", backend=backend.name, error=str(e)[:200])
+            return None
+        finally:
+            await self._release(backend)
+        backend.breaker.record_success()
+        if result:
+            backend.latencies.append(time.monotonic() - started)
+        return result
+
+    async def _hedged_attempt(self, primary: ImageBackend, prompt: str, tried: set) -> Optional[str]:
+        primary_task = asyncio.create_task(self._attempt(primary, prompt))
+        tasks = {primary_task}
+        try:
+            hedge_after = primary.latency_p95() or HEDGE_DEFAULT_SECONDS
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if done:
+                return primary_task.result()
+
+            secondary = await self._acquire(tried, wait=False)
+            if secondary is None:
+                return await primary_task
+            tried.add(secondary.name)
+            print(f"[generate] {primary.name} slower than {hedge_after:.1f}s, hedging to {secondary.name}")
+            _emit_generation_event("hedge", primary=primary.name, secondary=secondary.name, after_seconds=round(hedge_after, 1))
+            tasks.add(asyncio.create_task(self._attempt(secondary, prompt)))
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        return task.result()
+            return None
+        finally:
+            # Also runs when the caller is cancelled, so no attempt outlives it
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def generate(self, prompt: str) -> Optional[str]:
+        deadline = time.monotonic() + IMAGE_GENERATE_DEADLINE_SECONDS
+        tried: set = set()
+        while time.monotonic() < deadline:
+            backend = await self._acquire(tried)
+            if backend is None:
+                # Nothing healthy left: wait for the earliest open breaker to allow a probe
+                recovering = [b for b in self.backends if b.breaker.state != "closed"]
+                if not recovering:
+                    return None
+                reopen_at = min(b.breaker.open_until for b in recovering)
+                if reopen_at > deadline:
+                    return None
+                wait = max(reopen_at - time.monotonic(), 1.0)
+                print(f"[generate] All backends throttled — waiting {wait:.0f}s")
+                _emit_generation_event("waiting", seconds=round(wait))
+                await asyncio.sleep(wait)
+                tried -= {b.name for b in recovering if b.breaker.available()}
+                continue
+            tried.add(backend.name)
+            result = await self._hedged_attempt(backend, prompt, tried)
+            if result:
+                return result
+            print(f"[generate] {backend.name} failed, trying next backend")
+            _emit_generation_event("fallback", failed_backend=backend.name)
+        return None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "name": b.name,
+                "tier": b.tier,
+                "weight": b.weight,
+                "max_concurrency": b.max_concurrency,
+                "in_flight": b.in_flight,
+                "total_requests": b.total_requests,
+                "breaker": b.breaker.state,
+                "latency_p95": b.latency_p95(),
+                **({
+                    "token_seconds_left": round(b.token_seconds_left()),
+                    "token_refreshes": b.token_refreshes,
+                    "token_refresh_failures": b.token_refresh_failures,
+                    "token_refresh_last_seconds": b.token_refresh_last_seconds,
+                    "token_refresh_last_error": b.token_refresh_last_error,
+                } if b.credentials else {}),
+            }
+            for b in self.backends
+        ]
+
+
+def _build_image_backends() -> List[ImageBackend]:
+    backends = []
+    for index in range(1, IMAGE_BACKEND_MAX_INDEX + 1):
+        project_id = _env_suffixed("GCP_PROJECT_ID", index)
+        if not project_id:
+            continue
+        credentials = _load_vertex_credentials(index)
+        if not credentials:
+            continue
+        location = _env_suffixed("GCP_LOCATION", index, "us-central1")
+        backends.append(ImageBackend(
+            name=f"Vertex AI #{index}",
+            url=(
+                f"https://{location}-aiplatform.googleapis.com/v1/"
+                f"projects/{project_id}/locations/{location}/"
+                f"publishers/google/models/{VERTEX_MODEL}:predict"
+            ),
+            weight=float(_env_suffixed("VERTEX_WEIGHT", index, "1")),
+            max_concurrency=int(_env_suffixed("VERTEX_MAX_CONCURRENCY", index, "8")),
+            tier=0,
+            credentials=credentials,
+        ))
+
+    # Fallback: Gemini API keys (free tier, rate limited)
+    for index in range(1, IMAGE_BACKEND_MAX_INDEX + 1):
+        key = _env_suffixed("GEMINI_API_KEY", index)
+        if not key:
+            continue
+        backends.append(ImageBackend(
+            name=f"Gemini API #{index}",
+            url=f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:predict",
+            weight=float(_env_suffixed("GEMINI_WEIGHT", index, "1")),
+            max_concurrency=int(_env_suffixed("GEMINI_MAX_CONCURRENCY", index, "2")),
+            tier=1,
+            api_key=key,
+        ))
+    return backends
+
+
+_image_pool = ImageBackendPool(_build_image_backends())
+_vertex_count = sum(1 for b in _image_pool.backends if b.tier == 0)
+_gemini_count = len(_image_pool.backends) - _vertex_count
+if _vertex_count:
+    print(f"[startup] ✅ {_vertex_count} Vertex AI instance(s) configured, {_gemini_count} Gemini fallback key(s)")
+else:
+    print(f"[startup] ⚠️  Vertex AI credentials NOT found, falling back to {_gemini_count} Gemini API key(s)")
+
 
-    return f"""A 2D PAINTING on canvas. 8K hyper-detailed. The painting covers the entire image edge to edge.
-Style: {movement}
+async def _vertex_token_refresh_loop() -> None:
+    """Keep every Vertex token refreshed ahead of expiry so requests never wait on Google."""
+    vertex_backends = [b for b in _image_pool.backends if b.credentials]
+    if not vertex_backends:
+        return
+    while True:
+        for backend in vertex_backends:
+            if backend.token_seconds_left() <= TOKEN_REFRESH_MARGIN_SECONDS:
+                try:
+                    await backend.refresh_token()
+                    print(f"[generate] {backend.name} token refreshed in {backend.token_refresh_last_seconds}s")
+                except Exception:
+                    pass  # recorded in the backend's metrics; retried next pass
+        # Wake up shortly before the earliest token enters the refresh margin
+        next_due = min(b.token_seconds_left() for b in vertex_backends) - TOKEN_REFRESH_MARGIN_SECONDS
+        await asyncio.sleep(min(max(next_due, 30.0), 600.0))
 
-{get_density_directive(m["lines_of_code"])}
-COMPOSITION: Flatbed picture plane (no horizon, no depth). Pure FLAT painted surface.
 
-PAINTED COLOR PALETTE:
-{get_element_color_palette(m)}
+async def generate_image_with_imagen(prompt: str) -> Optional[str]:
+    if not _image_pool.backends:
+        raise HTTPException(status_code=500, detail="No image generation credentials configured")
+    return await _image_pool.generate(prompt)
 
-PAINTING TECHNIQUE & SURFACE:
-{get_texture_overlays(m)}
-MEDIUM: Acrylic paint, oil paint, spray paint, ink on canvas. Purely 2D painted surface.
-Visible painted texture - thick impasto, thin washes, drips, splatters, brushstrokes.
 
-MARK-MAKING: {marks}
+# Generated images, addressed by content hash, with a prompt-hash -> image-hash index
+_image_store = ImageStore(
+    os.path.join(CACHE_DIR, "images"),
+    max_bytes=int(float(os.getenv("IMAGE_CACHE_MAX_MB", "500")) * 1024 * 1024),
+)
+_image_prompt_cache = PersistentTTLCache(
+    "image_prompts",
+    max_entries=int(os.getenv("IMAGE_PROMPT_CACHE_SIZE", "5000")),
+    ttl_seconds=float(os.getenv("IMAGE_PROMPT_CACHE_TTL", str(365 * 24 * 3600))),
+)
 
-SURFACE: Painted marks only - NO objects. Colors suggest depth through layering and texture.
-Thick paint application, matte/glossy contrasts, visible brushwork evidence.
-Gothic-Baroque-Pop fusion - ornate painted patterns meets flat color fields.
-This took months of painting. Masterful 2D craftsmanship.
 
-CRITICAL: 100% ABSTRACT 2D PAINTING on canvas. NO objects, text, numbers, faces, depth.
-Pure painted abstract marks. Flat surface covered edge-to-edge with dense painted detail.
-NO borders, NO surrounding space, NO walls, NO floor, NO mat. Art bleeds past every edge."""
+# Metrics for identical content are identical; bump the version when compute_metrics changes
+CODE_METRICS_VERSION = 1
+_code_metrics_cache = (
+    PersistentTTLCache(
+        "code_metrics",
+        max_entries=int(os.getenv("CODE_METRICS_CACHE_SIZE", "20000")),
+        ttl_seconds=float(os.getenv("CODE_METRICS_CACHE_TTL", str(30 * 24 * 3600))),
+    )
+    if os.getenv("CODE_METRICS_CACHE_PERSIST", "1") != "0"
+    else MemoryLRUCache(int(os.getenv("CODE_METRICS_CACHE_SIZE", "20000")))
+)
 
 
-def _get_vertex_access_token() -> str:
-    """Get a fresh access token from service account credentials (Vertex AI #1)."""
-    import google.auth.transport.requests as google_requests
-    if not _vertex_credentials.valid or _vertex_credentials.expired:
-        _vertex_credentials.refresh(google_requests.Request())
-    return _vertex_credentials.token
+def _code_metrics_key(code: str, language: Optional[str], path: Optional[str]) -> str:
+    # Language is resolved from (language, extension, content), so those inputs key the result
+    ext = os.path.splitext(path)[1].lower() if path else ""
+    digest = hashlib.sha256(code.encode("utf-8")).hexdigest()
+    return f"v{CODE_METRICS_VERSION}:{language or ''}:{ext}:{digest}"
 
 
-def _get_vertex_access_token_2() -> str:
-    """Get a fresh access token from service account credentials (Vertex AI #2)."""
-    import google.auth.transport.requests as google_requests
-    if not _vertex_credentials_2.valid or _vertex_credentials_2.expired:
-        _vertex_credentials_2.refresh(google_requests.Request())
-    return _vertex_credentials_2.token
+def _prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
 
 
-_backend_counter = 0  # round-robin between backends
+def _cached_image_for_prompt(prompt: str) -> Optional[str]:
+    """Return the stored image hash for a prompt, if the image is still in the store."""
+    image_hash = _image_prompt_cache.get(_prompt_hash(prompt))
+    return image_hash if image_hash and _image_store.contains(image_hash) else None
 
 
-async def _call_vertex(prompt: str) -> Optional[str]:
-    """Call Vertex AI #1 with retry on 429."""
-    url = (
-        f"https://{GCP_LOCATION}-aiplatform.googleapis.com/v1/"
-        f"projects/{GCP_PROJECT_ID}/locations/{GCP_LOCATION}/"
-        f"publishers/google/models/imagen-3.0-generate-002:predict"
-    )
-    body = {"instances": [{"prompt": prompt}], "parameters": {"sampleCount": 1, "aspectRatio": "1:1"}}
+def _image_url(image_hash: str) -> str:
+    return f"/api/images/{image_hash}"
 
-    for attempt in range(1, 4):
-        token = _get_vertex_access_token()
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        print(f"[generate] Vertex AI #1 attempt {attempt}/3")
-        timeout = httpx.Timeout(90.0, connect=10.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(url, headers=headers, json=body)
-        if response.status_code == 429:
-            wait = attempt * 15
-            print(f"[generate] Vertex #1 429 — waiting {wait}s...")
-            await asyncio.sleep(wait)
-            continue
-        if response.status_code >= 400:
-            print(f"[generate] Vertex #1 error {response.status_code}: {response.text[:300]}")
-            return None
-        predictions = response.json().get("predictions", [])
-        return predictions[0].get("bytesBase64Encoded") if predictions else None
-    return None
 
+def _store_image_for_prompt(prompt: str, b64: str) -> str:
+    image_hash = _image_store.put(base64.b64decode(b64))
+    _image_prompt_cache.set(_prompt_hash(prompt), image_hash)
+    return image_hash
 
-async def _call_vertex_2(prompt: str) -> Optional[str]:
-    """Call Vertex AI #2 with retry on 429."""
-    url = (
-        f"https://{GCP_LOCATION_2}-aiplatform.googleapis.com/v1/"
-        f"projects/{GCP_PROJECT_ID_2}/locations/{GCP_LOCATION_2}/"
-        f"publishers/google/models/imagen-3.0-generate-002:predict"
-    )
-    body = {"instances": [{"prompt": prompt}], "parameters": {"sampleCount": 1, "aspectRatio": "1:1"}}
 
-    for attempt in range(1, 4):
-        token = _get_vertex_access_token_2()
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        print(f"[generate] Vertex AI #2 attempt {attempt}/3")
-        timeout = httpx.Timeout(90.0, connect=10.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(url, headers=headers, json=body)
-        if response.status_code == 429:
-            wait = attempt * 15
-            print(f"[generate] Vertex #2 429 — waiting {wait}s...")
-            await asyncio.sleep(wait)
-            continue
-        if response.status_code >= 400:
-            print(f"[generate] Vertex #2 error {response.status_code}: {response.text[:300]}")
-            return None
-        predictions = response.json().get("predictions", [])
-        return predictions[0].get("bytesBase64Encoded") if predictions else None
-    return None
+class GenerateRequest(BaseModel):
+    code: Optional[str] = None
+    language: Optional[str] = None
+    file_path: Optional[str] = None  # Lets the extension pick the language without sniffing
+    prompt: Optional[str] = None  # Direct Imagen prompt (from placard generation)
+    deterministic: bool = False  # Seed prompt choices from the code so results are cacheable
 
 
-async def _call_gemini(prompt: str) -> Optional[str]:
-    """Call free Gemini API with retry on 429."""
-    global _gemini_key_index
-    key = _gemini_keys[_gemini_key_index % len(_gemini_keys)]
-    _gemini_key_index += 1
-    url = "https://generativelanguage.googleapis.com/v1beta/models/imagen-4.0-generate-001:predict"
-    body = {"instances": [{"prompt": prompt}], "parameters": {"sampleCount": 1, "aspectRatio": "1:1"}}
+def analyze_code_metrics(code: str, language: Optional[str], path: Optional[str] = None) -> dict:
+    """The CPU-heavy half of prompt building: resolve the language and compute metrics."""
+    language = resolve_language(code, path, language)
+    print(f"[generate] Analyzing code ({len(code)} chars, language={language})")
+    return compute_metrics(code, language, analyze_code(code))
 
-    for attempt in range(1, 4):
-        headers = {"x-goog-api-key": key, "Content-Type": "application/json"}
-        print(f"[generate] Gemini API attempt {attempt}/3")
-        timeout = httpx.Timeout(90.0, connect=10.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(url, headers=headers, json=body)
-        if response.status_code == 429:
-            wait = attempt * 15
-            print(f"[generate] Gemini 429 — waiting {wait}s...")
-            await asyncio.sleep(wait)
-            continue
-        if response.status_code >= 400:
-            print(f"[generate] Gemini error {response.status_code}: {response.text[:200]}")
-            return None
-        predictions = response.json().get("predictions", [])
-        return predictions[0].get("bytesBase64Encoded") if predictions else None
-    return None
 
+def prompt_from_metrics(metrics: dict, code: str, deterministic: bool) -> str:
+    # Deterministic mode: same code (and language) -> same prompt
+    rng = random.Random(_prompt_hash(f"{metrics['language']}\n{code}")) if deterministic else random
+    return rng.choice([generate_dalle_prompt, generate_gallery_prompt])(metrics, rng)
 
-async def generate_image_with_imagen(prompt: str) -> Optional[str]:
-    global _backend_counter
-    has_vertex = bool(_vertex_credentials and GCP_PROJECT_ID)
-    has_vertex_2 = bool(_vertex_credentials_2 and GCP_PROJECT_ID_2)
-    has_gemini = bool(_gemini_keys)
-
-    # DUAL Vertex AI: Round-robin between two instances for 2x speed
-    if has_vertex and has_vertex_2:
-        use_vertex_2 = (_backend_counter % 2 == 1)
-        _backend_counter += 1
-        instance = "#2" if use_vertex_2 else "#1"
-        print(f"[generate] DUAL Vertex AI → Instance {instance} (request #{_backend_counter})")
-
-        result = await (_call_vertex_2(prompt) if use_vertex_2 else _call_vertex(prompt))
-        if result:
-            return result
-        # Fallback to the other Vertex instance
-        print(f"[generate] Vertex {instance} failed, trying other instance")
-        fallback = await (_call_vertex(prompt) if use_vertex_2 else _call_vertex_2(prompt))
-        if fallback:
-            return fallback
-        # Last resort: Gemini
-        if has_gemini:
-            print(f"[generate] Both Vertex instances failed, falling back to Gemini API")
-            return await _call_gemini(prompt)
-        return None
 
-    # Single Vertex AI instance
-    elif has_vertex:
-        print(f"[generate] Using Vertex AI Imagen 3 (single instance)")
-        result = await _call_vertex(prompt)
-        if result:
-            return result
-        if has_gemini:
-            print(f"[generate] Vertex failed, falling back to Gemini API")
-            return await _call_gemini(prompt)
-        return None
+async def generate_image_for_prompt(prompt: str) -> tuple:
+    """Return (image_hash, cached) for a prompt, or (None, False) if generation failed."""
+    image_hash = _cached_image_for_prompt(prompt)
+    if image_hash:
+        print(f"[generate] Image cache hit, skipping Imagen")
+        _emit_generation_event("cache_hit")
+        return image_hash, True
+
+    b64 = await generate_image_with_imagen(prompt)
+    if not b64:
+        return None, False
+    return _store_image_for_prompt(prompt, b64), False
 
-    # Gemini API only
-    elif has_gemini:
-        print(f"[generate] Using Gemini API (Vertex not configured)")
-        return await _call_gemini(prompt)
 
+async def code_metrics(code: str, language: Optional[str], path: Optional[str] = None) -> dict:
+    """Metrics for (already truncated) code, from the memo or the analysis pool."""
+    key = _code_metrics_key(code, language, path)
+    metrics = _code_metrics_cache.get(key)
+    if metrics is None:
+        metrics = await _analysis_pool.run(analyze_code_metrics, code, language, path, size=len(code))
+        _code_metrics_cache.set(key, metrics)
     else:
-        raise HTTPException(status_code=500, detail="No image generation credentials configured")
+        print(f"[generate] Metrics cache hit ({len(code)} chars)")
+    return metrics
 
 
-class GenerateRequest(BaseModel):
-    code: Optional[str] = None
-    language: Optional[str] = None
-    prompt: Optional[str] = None  # Direct Imagen prompt (from placard generation)
+async def build_prompt_from_code(code: str, language: Optional[str], deterministic: bool,
+                                path: Optional[str] = None) -> tuple:
+    """Analyze code and build an Imagen prompt, returning (prompt, metrics)."""
+    code = code[:CODE_ANALYSIS_MAX_CHARS]
+    metrics = await code_metrics(code, language, path)
+    return prompt_from_metrics(metrics, code, deterministic), metrics
 
 
-@app.post("/api/generate")
-async def generate_art(payload: GenerateRequest):
+async def _resolve_generate_prompt(payload: GenerateRequest) -> tuple:
+    """Return (prompt, metrics) for a GenerateRequest."""
     # If prompt is provided directly, use it (new flow from placard generation)
     if payload.prompt:
-        prompt = payload.prompt
-        metrics = {}
-        print(f"[generate] Using provided prompt ({len(prompt)} chars), calling Imagen...")
+        print(f"[generate] Using provided prompt ({len(payload.prompt)} chars), calling Imagen...")
+        return payload.prompt, {}
 
     # Otherwise, generate prompt from code (legacy flow)
-    elif payload.code:
-        code = payload.code[:1800]
-        language = payload.language or detect_language(code)
-
-        print(f"[generate] Analyzing code ({len(code)} chars, language={language})")
+    if payload.code:
+        prompt, metrics = await build_prompt_from_code(
+            payload.code, payload.language, payload.deterministic, payload.file_path
+        )
+        print(f"[generate] Prompt generated ({len(prompt)} chars), calling Imagen...")
+        return prompt, metrics
 
-        signals = analyze_code(code)
-        metrics = compute_metrics(code, language, signals)
+    raise HTTPException(status_code=400, detail="Either 'code' or 'prompt' must be provided")
 
-        prompt = random.choice([generate_dalle_prompt, generate_gallery_prompt])(metrics)
-        print(f"[generate] Prompt generated ({len(prompt)} chars), calling Imagen...")
 
-    else:
-        raise HTTPException(status_code=400, detail="Either 'code' or 'prompt' must be provided")
+@app.post("/api/generate")
+async def generate_art(payload: GenerateRequest):
+    prompt, metrics = await _resolve_generate_prompt(payload)
 
-    b64 = await generate_image_with_imagen(prompt)
+    image_hash, cached = await generate_image_for_prompt(prompt)
 
-    if not b64:
+    if not image_hash:
         return JSONResponse(
             {"error": "Image generation failed", "prompt_used": prompt},
             status_code=500,
@@ -836,28 +2396,255 @@ async def generate_art(payload: GenerateRequest):
 
     print(f"[generate] Image generated successfully")
     return {
-        "image_data_url": f"data:image/png;base64,{b64}",
+        "image_url": _image_url(image_hash),
         "prompt_used": prompt,
         "metrics": metrics,
+        "cached": cached,
     }
 
 
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/api/generate/stream")
+async def generate_art_stream(payload: GenerateRequest):
+    """
+    Server-sent-events variant of /api/generate that reports progress.
+
+    Events: prompt, queued (position), backend (chosen backend), throttled,
+    backend_error, hedge, fallback, waiting, cache_hit, then complete (same
+    body as /api/generate) or error. Closing the connection cancels the
+    generation and frees its backend slot.
+    """
+    prompt, metrics = await _resolve_generate_prompt(payload)
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def run() -> None:
+        _generation_events.set(events)
+        try:
+            image_hash, cached = await generate_image_for_prompt(prompt)
+            if image_hash:
+                events.put_nowait(("complete", {
+                    "image_url": _image_url(image_hash),
+                    "prompt_used": prompt,
+                    "metrics": metrics,
+                    "cached": cached,
+                }))
+            else:
+                events.put_nowait(("error", {"error": "Image generation failed", "prompt_used": prompt}))
+        except Exception as e:
+            events.put_nowait(("error", {"error": str(e), "prompt_used": prompt}))
+        finally:
+            events.put_nowait(None)
+
+    async def stream() -> AsyncIterator[str]:
+        task = asyncio.create_task(run())
+        try:
+            yield _sse("prompt", {"prompt_used": prompt, "metrics": metrics})
+            while True:
+                item = await events.get()
+                if item is None:
+                    break
+                yield _sse(*item)
+        finally:
+            if not task.done():
+                print("[generate] Client went away, cancelling generation")
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class BatchGenerateRequest(BaseModel):
+    # path -> {"full_content": ..., "snippet": ..., ...}: extracted_code_files from /api/extract,
+    # or analysis.important_files (snippet only) as a fallback
+    important_files: Dict[str, Dict[str, Any]] = Field(..., min_length=1)
+    deterministic: bool = True
+
+
+# Batch generation shares one limit across requests, sized to the pool's capacity
+IMAGE_BATCH_CONCURRENCY = max(1, sum(b.max_concurrency or 8 for b in _image_pool.backends))
+_image_batch_slots = asyncio.Semaphore(IMAGE_BATCH_CONCURRENCY)
+
+
+@app.post("/api/generate/batch")
+async def generate_art_batch(payload: BatchGenerateRequest):
+    """
+    Generate artworks for every file of an extraction in one request.
+
+    Metrics for all files are computed up front and profiled as one matrix,
+    so palettes and mediums describe each file relative to the rest of the
+    repo. Files that produce the same prompt share a single Imagen call, and
+    calls are spread across the backend pool under a global concurrency
+    limit. Results stream back as NDJSON, one {"path": ..., "image_url": ...}
+    line per file as soon as its image is ready, followed by a
+    {"done": true, ...} summary line that includes the repo profile.
+    """
+    files = []  # (path, code, language)
+    for path, file_data in payload.important_files.items():
+        code = (file_data.get("full_content") or file_data.get("snippet") or "")[:CODE_ANALYSIS_MAX_CHARS]
+        if code.strip():
+            files.append((path, code, file_data.get("language")))
+    file_metrics = await asyncio.gather(*(code_metrics(code, language, path) for path, code, language in files))
+    profile = RepoMetricProfile(file_metrics)
+
+    prompts: Dict[str, List[tuple]] = {}  # prompt -> [(path, metrics), ...]
+    for i, ((path, code, _), metrics) in enumerate(zip(files, file_metrics)):
+        relative = profile.relative(i)
+        if relative:
+            metrics = {**metrics, "repo_relative": relative}
+        prompt = prompt_from_metrics(metrics, code, payload.deterministic)
+        prompts.setdefault(prompt, []).append((path, metrics))
+    total = sum(len(entries) for entries in prompts.values())
+    print(f"[generate] Batch: {total} files, {len(prompts)} unique prompts, concurrency {IMAGE_BATCH_CONCURRENCY}")
+
+    async def generate_one(prompt: str) -> tuple:
+        async with _image_batch_slots:
+            try:
+                return prompt, await generate_image_for_prompt(prompt)
+            except Exception as e:
+                print(f"[generate] Batch item failed: {e}")
+                return prompt, (None, False)
+
+    async def lines() -> AsyncIterator[str]:
+        tasks = [asyncio.create_task(generate_one(prompt)) for prompt in prompts]
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                prompt, (image_hash, cached) = await next_done
+                for path, metrics in prompts[prompt]:
+                    if image_hash:
+                        line = {
+                            "path": path,
+                            "image_url": _image_url(image_hash),
+                            "prompt_used": prompt,
+                            "metrics": metrics,
+                            "cached": cached,
+                        }
+                    else:
+                        failed += 1
+                        line = {"path": path, "error": "Image generation failed", "prompt_used": prompt}
+                    yield json.dumps(line) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        print(f"[generate] Batch complete: {total - failed}/{total} images")
+        yield json.dumps({"done": True, "count": total, "failed": failed, "repo_profile": profile.summary()}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/api/images/{image_hash}")
+async def get_image(image_hash: str, request: Request):
+    """Serve a generated image. Content-addressed, so it is cacheable forever."""
+    path = _image_store.path(image_hash)
+    if not path:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    etag = f'"{image_hash}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    # FileResponse handles Range / If-Range requests
+    return FileResponse(path, media_type="image/png", headers=headers)
+
+
 # ============================================
 # Placard Generation with Claude Haiku
 # ============================================
 
-async def call_claude_for_placard(
+PLACARD_MODEL = "claude-3-5-haiku-20241022"
+# Identical inputs produce an equivalent placard; keep them for a month
+_placard_cache = PersistentTTLCache(
+    "placards",
+    max_entries=int(os.getenv("PLACARD_CACHE_SIZE", "5000")),
+    ttl_seconds=float(os.getenv("PLACARD_CACHE_TTL", str(30 * 24 * 3600))),
+)
+PLACARD_NEGATIVE_TTL_SECONDS = float(os.getenv("PLACARD_NEGATIVE_TTL", "300"))
+
+
+def _normalize_placard_text(text: str) -> str:
+    """Line endings and trailing whitespace don't change a placard."""
+    return "\n".join(line.rstrip() for line in text.replace("\r\n", "\n").split("\n")).strip()
+
+
+def _placard_cache_key(claude_prompt: str) -> str:
+    # The rendered prompt covers every normalized input and the template itself
+    return hashlib.sha256(f"{PLACARD_MODEL}\n{claude_prompt}".encode("utf-8")).hexdigest()
+
+
+class PlacardRateLimiter:
+    """
+    Shared by every Claude placard call: a concurrency cap, requests-per-minute
+    pacing, and one back-off window that all callers honor after a 429.
+    """
+
+    def __init__(self, concurrency: int, per_minute: float):
+        self._slots = asyncio.Semaphore(concurrency)
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next_at = 0.0
+        self._paused_until = 0.0
+        self.throttled = 0
+
+    async def __aenter__(self):
+        await self._slots.acquire()
+        try:
+            now = time.monotonic()
+            start = max(now, self._next_at)
+            self._next_at = start + self.interval
+            await asyncio.sleep(start - now)
+            # A 429 elsewhere pauses everyone, including callers already scheduled
+            while self._paused_until > time.monotonic():
+                await asyncio.sleep(self._paused_until - time.monotonic())
+        except BaseException:
+            self._slots.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._slots.release()
+
+    def back_off(self, seconds: float) -> None:
+        self.throttled += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+_placard_limiter = PlacardRateLimiter(
+    concurrency=int(os.getenv("PLACARD_CONCURRENCY", "4")),
+    per_minute=float(os.getenv("PLACARD_REQUESTS_PER_MINUTE", "50")),
+)
+ANTHROPIC_API_BASE = "https://api.anthropic.com/v1"
+
+
+def _anthropic_headers() -> Dict[str, str]:
+    return {
+        "x-api-key": ANTHROPIC_API_KEY,
+        "anthropic-version": "2023-06-01",
+        "Content-Type": "application/json"
+    }
+
+
+def build_placard_prompt(
     imagen_prompt: str,
     code_snippet: str,
     file_path: str,
     language: str,
     repo_name: str,
     username: str
-) -> Dict[str, Any]:
-    """Call Claude Haiku to generate placard description based on the generated artwork"""
-
-    if not ANTHROPIC_API_KEY:
-        raise HTTPException(status_code=500, detail="Anthropic API key not configured")
+) -> str:
+    """Render the curator prompt from normalized inputs."""
+    imagen_prompt = _normalize_placard_text(imagen_prompt)
+    code_snippet = _normalize_placard_text(code_snippet)
+    file_path = file_path.strip().replace("\\", "/").removeprefix("./")
+    repo_name = repo_name.strip()
+    username = username.strip().lstrip("@")
 
     # Build the prompt for Claude
     claude_prompt = f"""You are a sophisticated museum curator writing a placard for "Syntaxesia" - an art exhibition where code is transformed into abstract post-modern artworks.
@@ -871,8 +2658,8 @@ Code File Information:
 - Repository: {repo_name}
 - Author: @{username}
 
-Code Sample (first 500 chars):
-{code_snippet[:500]}
+Code Sample (most representative ~500 chars):
+{interesting_excerpt(code_snippet, 500)}
 
 Your task: Write a museum placard that describes this artwork. The placard should:
 
@@ -911,15 +2698,12 @@ Return ONLY valid JSON in this format:
   "artistDescription": "1 sentence describing the artist's work (general, factual, non-hyperbolic)",
   "placardDescription": "your placard description here (two paragraphs separated by blank line)"
 }}"""
+    return claude_prompt
 
-    url = "https://api.anthropic.com/v1/messages"
-    headers = {
-        "x-api-key": ANTHROPIC_API_KEY,
-        "anthropic-version": "2023-06-01",
-        "Content-Type": "application/json"
-    }
-    body = {
-        "model": "claude-3-5-haiku-20241022",
+
+def _placard_message_params(claude_prompt: str) -> Dict[str, Any]:
+    return {
+        "model": PLACARD_MODEL,
         "max_tokens": 1024,
         "temperature": 0.7,
         "messages": [{
@@ -928,15 +2712,80 @@ Return ONLY valid JSON in this format:
         }]
     }
 
+
+def _cached_placard(cache_key: str, file_path: str) -> Optional[Dict[str, Any]]:
+    """Cached placard JSON; raises for a cached failure; None on a miss."""
+    cached = _placard_cache.get(cache_key)
+    if cached is not None:
+        if "error" in cached:
+            print(f"[placard] Cached failure for {file_path}, not retrying yet")
+            raise HTTPException(status_code=500, detail=cached["error"])
+        print(f"[placard] Cache hit for {file_path}")
+    return cached
+
+
+def _parse_placard_text(text: str, cache_key: str) -> Dict[str, Any]:
+    """Parse Claude's JSON answer and cache the outcome, failures included."""
+    # Parse JSON from response (handle markdown code blocks)
+    text = text.strip()
+    text = re.sub(r"^```json\s*", "", text)
+    text = re.sub(r"^```\s*", "", text)
+    text = re.sub(r"```\s*$", "", text)
+    text = text.strip()
+
+    try:
+        placard = json.loads(text)
+    except json.JSONDecodeError as e:
+        print(f"[placard] Failed to parse JSON: {e}")
+        print(f"[placard] Raw text: {text[:500]}")
+        detail = "Failed to parse Claude response as JSON"
+        # Negative entry: identical inputs fail fast for a while instead of re-calling Claude
+        _placard_cache.set(cache_key, {"error": detail}, ttl_seconds=PLACARD_NEGATIVE_TTL_SECONDS)
+        raise HTTPException(status_code=500, detail=detail)
+    _placard_cache.set(cache_key, placard)
+    return placard
+
+
+def _retry_after_seconds(response: httpx.Response, default: float) -> float:
+    try:
+        return max(float(response.headers.get("retry-after", default)), 1.0)
+    except ValueError:
+        return default
+
+
+async def call_claude_for_placard(
+    imagen_prompt: str,
+    code_snippet: str,
+    file_path: str,
+    language: str,
+    repo_name: str,
+    username: str
+) -> Dict[str, Any]:
+    """Call Claude Haiku to generate placard description based on the generated artwork"""
+
+    if not ANTHROPIC_API_KEY:
+        raise HTTPException(status_code=500, detail="Anthropic API key not configured")
+
+    claude_prompt = build_placard_prompt(imagen_prompt, code_snippet, file_path, language, repo_name, username)
+    cache_key = _placard_cache_key(claude_prompt)
+    cached = _cached_placard(cache_key, file_path)
+    if cached is not None:
+        return cached
+
     for attempt in range(1, 4):
         timeout = httpx.Timeout(30.0, connect=10.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(url, headers=headers, json=body)
+        async with _placard_limiter:
+            async with httpx.AsyncClient(timeout=timeout) as client:
+                response = await client.post(
+                    f"{ANTHROPIC_API_BASE}/messages",
+                    headers=_anthropic_headers(),
+                    json=_placard_message_params(claude_prompt),
+                )
 
         if response.status_code == 429:
-            wait = attempt * 10
-            print(f"[placard] Claude 429 — waiting {wait}s...")
-            await asyncio.sleep(wait)
+            wait = _retry_after_seconds(response, attempt * 10)
+            print(f"[placard] Claude 429 — pausing all placard calls for {wait:.0f}s...")
+            _placard_limiter.back_off(wait)
             continue
 
         if response.status_code >= 400:
@@ -949,20 +2798,7 @@ Return ONLY valid JSON in this format:
 
         data = response.json()
         text = data.get("content", [{}])[0].get("text", "")
-
-        # Parse JSON from response (handle markdown code blocks)
-        text = text.strip()
-        text = re.sub(r"^```json\s*", "", text)
-        text = re.sub(r"^```\s*", "", text)
-        text = re.sub(r"```\s*$", "", text)
-        text = text.strip()
-
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError as e:
-            print(f"[placard] Failed to parse JSON: {e}")
-            print(f"[placard] Raw text: {text[:500]}")
-            raise HTTPException(status_code=500, detail="Failed to parse Claude response as JSON")
+        return _parse_placard_text(text, cache_key)
 
     raise HTTPException(status_code=500, detail="Claude API retry limit exceeded")
 
@@ -997,8 +2833,9 @@ async def extract_github_repo(payload: ExtractRequest):
         github_token = os.getenv("GITHUB_TOKEN", "").strip() or None
         extractor = GitHubExtractor(github_token=github_token)
 
-        # Extract repository data
-        repo_data = extractor.extract(github_url)
+        # Network calls run on a thread; README/tree analysis goes to the analysis pool
+        offload = _analysis_pool.offload_from_thread(asyncio.get_running_loop())
+        repo_data = await asyncio.to_thread(extractor.extract, github_url, offload)
 
         print(f"[extract] Extracted {len(repo_data.get('analysis', {}).get('important_files', {}))} files")
 
@@ -1024,6 +2861,24 @@ class PlacardRequest(BaseModel):
     year: Optional[str] = None
 
 
+def _build_placard(payload: PlacardRequest, claude_response: Dict[str, Any]) -> Dict[str, Any]:
+    """Complete placard object from the request and Claude's JSON fields."""
+    filename = os.path.basename(payload.file_path)
+    return {
+        "title": filename,
+        "filename": filename,
+        "filePath": payload.file_path,
+        "artist": f"Code by @{payload.username}",
+        "medium": f"{payload.language}, {payload.year or '2024'}",
+        "year": payload.year or "",
+        "repoName": payload.repo_name,
+        "description": claude_response.get("placardDescription", ""),
+        "aestheticCategory": claude_response.get("aestheticCategory", ""),
+        "artistMatch": claude_response.get("artistMatch", ""),
+        "artistDescription": claude_response.get("artistDescription", "")
+    }
+
+
 @app.post("/api/placard")
 async def generate_placard(payload: PlacardRequest):
     """
@@ -1044,22 +2899,7 @@ async def generate_placard(payload: PlacardRequest):
             username=payload.username
         )
 
-        # Build complete placard object
-        filename = os.path.basename(payload.file_path)
-
-        placard = {
-            "title": filename,
-            "filename": filename,
-            "filePath": payload.file_path,
-            "artist": f"Code by @{payload.username}",
-            "medium": f"{payload.language}, {payload.year or '2024'}",
-            "year": payload.year or "",
-            "repoName": payload.repo_name,
-            "description": claude_response.get("placardDescription", ""),
-            "aestheticCategory": claude_response.get("aestheticCategory", ""),
-            "artistMatch": claude_response.get("artistMatch", ""),
-            "artistDescription": claude_response.get("artistDescription", "")
-        }
+        placard = _build_placard(payload, claude_response)
 
         print(f"[placard] Generated placard for {payload.file_path}")
 
@@ -1072,6 +2912,379 @@ async def generate_placard(payload: PlacardRequest):
         raise HTTPException(status_code=500, detail=f"Placard generation failed: {str(e)}")
 
 
+_END_OF_STRING = object()
+
+
+class PlacardFieldStream:
+    """
+    Incremental parser for Claude's flat JSON placard object.
+
+    feed() takes raw response text in arbitrary chunks (markdown fence and
+    all) and returns ("text", field, decoded_chars) for string values as they
+    arrive, plus ("field", field, full_value) once a value is complete.
+    """
+
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self):
+        self.state = "start"
+        self.field = ""
+        self._key: List[str] = []
+        self._value: List[str] = []
+        self._escape: Optional[str] = None  # None, "" right after a backslash, or "u" + hex digits
+        self._high_surrogate: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[tuple]:
+        events: List[tuple] = []
+        pending: List[str] = []  # decoded chars of the current value in this chunk
+
+        def flush():
+            if pending:
+                events.append(("text", self.field, "".join(pending)))
+                pending.clear()
+
+        for ch in chunk:
+            state = self.state
+            if state == "start":
+                if ch == "{":
+                    self.state = "seek_key"
+            elif state == "seek_key":
+                if ch == '"':
+                    self.state, self._key = "key", []
+                elif ch == "}":
+                    self.state = "done"
+            elif state == "key":
+                if self._escape is not None:
+                    self._key.append(self._ESCAPES.get(ch, ch))
+                    self._escape = None
+                elif ch == "\\":
+                    self._escape = ""
+                elif ch == '"':
+                    self.field, self.state = "".join(self._key), "seek_colon"
+                else:
+                    self._key.append(ch)
+            elif state == "seek_colon":
+                if ch == ":":
+                    self.state = "seek_value"
+            elif state == "seek_value":
+                if ch == '"':
+                    self.state, self._value = "string", []
+                elif not ch.isspace():
+                    self.state = "other"  # number/bool/null: not streamed
+            elif state == "other":
+                if ch in ",}":
+                    self.state = "seek_key" if ch == "," else "done"
+            elif state == "string":
+                decoded = self._decode(ch)
+                if decoded is None:
+                    continue
+                if decoded is _END_OF_STRING:
+                    flush()
+                    events.append(("field", self.field, "".join(self._value)))
+                    self.state = "seek_key"
+                    continue
+                pending.append(decoded)
+                self._value.append(decoded)
+        if self.state == "string":
+            flush()
+        return events
+
+    def _decode(self, ch: str):
+        """Decoded text for one string character, None while inside an escape."""
+        if self._escape is None:
+            if ch == "\\":
+                self._escape = ""
+                return None
+            return _END_OF_STRING if ch == '"' else ch
+        if self._escape == "" and ch != "u":
+            self._escape = None
+            return self._ESCAPES.get(ch, ch)
+        self._escape += ch
+        if len(self._escape) < 5:
+            return None
+        code = int(self._escape[1:], 16)
+        self._escape = None
+        if 0xD800 <= code < 0xDC00:
+            self._high_surrogate = code
+            return None
+        if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        return chr(code)
+
+
+async def _stream_claude_text(claude_prompt: str) -> AsyncIterator[str]:
+    """Yield text deltas of a streamed Claude message; 429s are retried before the first token."""
+    for attempt in range(1, 4):
+        timeout = httpx.Timeout(30.0, connect=10.0)
+        async with _placard_limiter:
+            async with httpx.AsyncClient(timeout=timeout) as client:
+                async with client.stream(
+                    "POST",
+                    f"{ANTHROPIC_API_BASE}/messages",
+                    headers=_anthropic_headers(),
+                    json={**_placard_message_params(claude_prompt), "stream": True},
+                ) as response:
+                    if response.status_code == 429:
+                        wait = _retry_after_seconds(response, attempt * 10)
+                        print(f"[placard] Claude 429 — pausing all placard calls for {wait:.0f}s...")
+                        _placard_limiter.back_off(wait)
+                        continue
+                    if response.status_code >= 400:
+                        error_text = (await response.aread()).decode("utf-8", "replace")[:500]
+                        print(f"[placard] Claude error {response.status_code}: {error_text}")
+                        raise HTTPException(
+                            status_code=500,
+                            detail=f"Claude API error {response.status_code}: {error_text}"
+                        )
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        event = json.loads(line[5:])
+                        if event.get("type") == "content_block_delta":
+                            delta = event.get("delta", {})
+                            if delta.get("type") == "text_delta":
+                                yield delta.get("text", "")
+                        elif event.get("type") == "error":
+                            message = event.get("error", {}).get("message", "stream error")
+                            raise HTTPException(status_code=500, detail=f"Claude stream error: {message}")
+                    return
+    raise HTTPException(status_code=500, detail="Claude API retry limit exceeded")
+
+
+@app.post("/api/placard/stream")
+async def generate_placard_stream(payload: PlacardRequest):
+    """
+    Server-sent-events variant of /api/placard.
+
+    "delta" events carry placardDescription text as Claude writes it, "field"
+    events announce the other fields once each is complete, and a final
+    "placard" event has the same body /api/placard returns (or "error").
+    """
+    if not ANTHROPIC_API_KEY:
+        raise HTTPException(status_code=500, detail="Anthropic API key not configured")
+    claude_prompt = build_placard_prompt(
+        payload.imagen_prompt, payload.code_snippet, payload.file_path,
+        payload.language, payload.repo_name, payload.username
+    )
+    cache_key = _placard_cache_key(claude_prompt)
+    print(f"[placard] Streaming placard for {payload.file_path}")
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            claude_response = _cached_placard(cache_key, payload.file_path)
+            if claude_response is None:
+                parser = PlacardFieldStream()
+                chunks: List[str] = []
+                async for chunk in _stream_claude_text(claude_prompt):
+                    chunks.append(chunk)
+                    for kind, field, text in parser.feed(chunk):
+                        if kind == "text" and field == "placardDescription":
+                            yield _sse("delta", {"text": text})
+                        elif kind == "field" and field != "placardDescription":
+                            yield _sse("field", {"name": field, "value": text})
+                claude_response = _parse_placard_text("".join(chunks), cache_key)
+            else:
+                yield _sse("delta", {"text": claude_response.get("placardDescription", "")})
+            yield _sse("placard", _build_placard(payload, claude_response))
+            print(f"[placard] Streamed placard for {payload.file_path}")
+        except HTTPException as e:
+            yield _sse("error", {"error": e.detail})
+        except Exception as e:
+            print(f"[placard] Stream error: {e}")
+            yield _sse("error", {"error": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+PLACARD_BATCH_MAX = 100
+PLACARD_BATCH_POLL_SECONDS = float(os.getenv("PLACARD_BATCH_POLL_SECONDS", "10"))
+PLACARD_BATCH_MAX_WAIT_SECONDS = float(os.getenv("PLACARD_BATCH_MAX_WAIT", "1800"))
+
+
+class BatchPlacardRequest(BaseModel):
+    placards: List[PlacardRequest] = Field(..., min_length=1, max_length=PLACARD_BATCH_MAX)
+    # Submit through Anthropic's Message Batches API and poll, instead of live calls
+    submit_as_batch: bool = False
+
+
+async def _placards_live(requests: List[PlacardRequest]) -> AsyncIterator[tuple]:
+    """Yield (index, claude_response or exception) as live calls finish."""
+    async def one(index: int, req: PlacardRequest) -> tuple:
+        try:
+            return index, await call_claude_for_placard(
+                imagen_prompt=req.imagen_prompt,
+                code_snippet=req.code_snippet,
+                file_path=req.file_path,
+                language=req.language,
+                repo_name=req.repo_name,
+                username=req.username
+            )
+        except Exception as e:
+            return index, e
+
+    tasks = [asyncio.create_task(one(i, req)) for i, req in enumerate(requests)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _placards_message_batch(requests: List[PlacardRequest]) -> AsyncIterator[tuple]:
+    """Yield (index, claude_response or exception): cache hits first, then one polled batch."""
+    pending: Dict[str, tuple] = {}  # custom_id -> (index, cache_key, prompt)
+    for i, req in enumerate(requests):
+        prompt = build_placard_prompt(
+            req.imagen_prompt, req.code_snippet, req.file_path, req.language, req.repo_name, req.username
+        )
+        cache_key = _placard_cache_key(prompt)
+        try:
+            cached = _cached_placard(cache_key, req.file_path)
+        except HTTPException as e:
+            yield i, e
+            continue
+        if cached is not None:
+            yield i, cached
+        else:
+            pending[f"placard-{i}"] = (i, cache_key, prompt)
+    if not pending:
+        return
+
+    headers = _anthropic_headers()
+    batch_id = None
+    ended = False
+    async with httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0)) as client:
+        try:
+            response = await client.post(
+                f"{ANTHROPIC_API_BASE}/messages/batches",
+                headers=headers,
+                json={"requests": [
+                    {"custom_id": custom_id, "params": _placard_message_params(prompt)}
+                    for custom_id, (_, _, prompt) in pending.items()
+                ]},
+            )
+            if response.status_code >= 400:
+                error = HTTPException(
+                    status_code=500,
+                    detail=f"Claude batch error {response.status_code}: {response.text[:500]}"
+                )
+                for index, _, _ in pending.values():
+                    yield index, error
+                return
+            batch = response.json()
+            batch_id = batch["id"]
+            print(f"[placard] Submitted batch {batch_id} with {len(pending)} placards")
+
+            deadline = time.monotonic() + PLACARD_BATCH_MAX_WAIT_SECONDS
+            while batch.get("processing_status") != "ended":
+                if time.monotonic() > deadline:
+                    error = HTTPException(status_code=504, detail="Claude batch did not finish in time")
+                    for index, _, _ in pending.values():
+                        yield index, error
+                    return
+                await asyncio.sleep(PLACARD_BATCH_POLL_SECONDS)
+                poll = await client.get(f"{ANTHROPIC_API_BASE}/messages/batches/{batch_id}", headers=headers)
+                if poll.status_code < 400:
+                    batch = poll.json()
+            ended = True
+
+            results = await client.get(batch["results_url"], headers=headers)
+            for line in results.text.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get("custom_id") not in pending:
+                    continue
+                index, cache_key, _ = pending.pop(entry["custom_id"])
+                result = entry.get("result", {})
+                if result.get("type") != "succeeded":
+                    yield index, HTTPException(
+                        status_code=500, detail=f"Claude batch request {result.get('type', 'failed')}"
+                    )
+                    continue
+                try:
+                    text = result["message"].get("content", [{}])[0].get("text", "")
+                    yield index, _parse_placard_text(text, cache_key)
+                except HTTPException as e:
+                    yield index, e
+            for index, _, _ in pending.values():
+                yield index, HTTPException(status_code=500, detail="Missing from Claude batch results")
+        finally:
+            if batch_id and not ended:
+                # Client went away or we gave up: don't leave the batch running
+                try:
+                    await client.post(f"{ANTHROPIC_API_BASE}/messages/batches/{batch_id}/cancel", headers=headers)
+                    print(f"[placard] Cancelled batch {batch_id}")
+                except Exception as e:
+                    print(f"[placard] Failed to cancel batch {batch_id}: {e}")
+
+
+@app.post("/api/placard/batch")
+async def generate_placard_batch(payload: BatchPlacardRequest):
+    """
+    Generate placards for every artwork of an exhibition in one request.
+
+    Live mode runs the Claude calls with bounded concurrency under the shared
+    placard rate limiter; submit_as_batch sends cache misses as one Message
+    Batches job and polls for it. Either way results stream back as NDJSON,
+    one {"index", "filePath", "placard"} (or "error") line per artwork as it
+    finishes, followed by a {"done": true, ...} summary line.
+    """
+    if not ANTHROPIC_API_KEY:
+        raise HTTPException(status_code=500, detail="Anthropic API key not configured")
+    requests = payload.placards
+    print(f"[placard] Batch of {len(requests)} ({'message batch' if payload.submit_as_batch else 'live'})")
+
+    async def lines() -> AsyncIterator[str]:
+        source = _placards_message_batch(requests) if payload.submit_as_batch else _placards_live(requests)
+        failed = 0
+        try:
+            async for index, result in source:
+                req = requests[index]
+                if isinstance(result, Exception):
+                    failed += 1
+                    detail = result.detail if isinstance(result, HTTPException) else str(result)
+                    line = {"index": index, "filePath": req.file_path, "error": detail}
+                else:
+                    line = {"index": index, "filePath": req.file_path, "placard": _build_placard(req, result)}
+                yield json.dumps(line) + "\n"
+        finally:
+            await source.aclose()
+        print(f"[placard] Batch complete: {len(requests) - failed}/{len(requests)} placards")
+        yield json.dumps({"done": True, "count": len(requests), "failed": failed}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# ============================================
+# Metrics
+# ============================================
+
+@app.get("/api/metrics")
+async def metrics():
+    """Runtime metrics: image backend pool state, cache hit ratios and analysis pool load."""
+    return {
+        "image_backends": _image_pool.stats(),
+        "caches": {
+            "met_objects": _met_object_cache.stats(),
+            "met_searches": _met_search_cache.stats(),
+            "met_artist_verdicts": _met_artist_verdicts.stats(),
+            "image_prompts": _image_prompt_cache.stats(),
+            "placards": _placard_cache.stats(),
+            "code_metrics": _code_metrics_cache.stats(),
+        },
+        "analysis": _analysis_pool.stats(),
+        "placard_limiter": {"throttled": _placard_limiter.throttled},
+    }
+
+
 # ============================================
 # Serve Vite frontend (production)
 # ============================================
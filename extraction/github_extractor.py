@@ -4,6 +4,56 @@ import re
 from typing import Dict, List, Any
 from urllib.parse import urlparse
 
+# Code file extensions we extract, and the language each one implies
+EXTENSION_LANGUAGES = {
+    '.py': 'python', '.js': 'javascript', '.jsx': 'javascript', '.ts': 'typescript',
+    '.tsx': 'typescript', '.rs': 'rust', '.go': 'go', '.java': 'java', '.c': 'c',
+    '.cpp': 'cpp', '.h': 'c', '.hpp': 'cpp', '.cs': 'csharp', '.rb': 'ruby',
+    '.php': 'php', '.swift': 'swift', '.kt': 'kotlin', '.scala': 'scala', '.sh': 'shell',
+    '.toml': 'toml', '.yaml': 'yaml', '.yml': 'yaml', '.json': 'json', '.xml': 'xml',
+    '.sql': 'sql', '.md': 'markdown'
+}
+
+# Constructs that make a stretch of code worth looking at: control flow, definitions, calls
+_INTERESTING_TOKEN = re.compile(
+    r"\b(?:if|elif|else|for|while|switch|case|match|try|catch|except|finally|def|function|fn|func"
+    r"|class|struct|impl|return|yield|async|await|lambda)\b|=>|\w\s*\("
+)
+# Lines that score nothing: blanks, comments, license banners, imports
+_BORING_LINE = re.compile(
+    r"\s*(?:$|#(?!include)|//|/\*|\*|--|import\s|from\s+\S+\s+import\s|package\s|using\s"
+    r"|#include\b|use\s|require\(|const\s+\w+\s*=\s*require\()"
+)
+
+
+def interesting_window(lines: List[str], size: int) -> int:
+    """
+    Start index of the size-line window with the most interesting constructs.
+
+    Each line is scored once and windows are compared through prefix sums,
+    so this is linear in the number of lines. Ties go to the earliest window.
+    """
+    if len(lines) <= size:
+        return 0
+    prefix = [0]
+    for line in lines:
+        score = 0 if _BORING_LINE.match(line) else len(_INTERESTING_TOKEN.findall(line))
+        prefix.append(prefix[-1] + score)
+    return max(range(len(lines) - size + 1), key=lambda i: prefix[i + size] - prefix[i])
+
+
+def interesting_excerpt(code: str, max_chars: int) -> str:
+    """The most interesting run of whole lines that fits in roughly max_chars."""
+    if len(code) <= max_chars:
+        return code
+    lines = code.split('\n')
+    non_empty = [len(line) + 1 for line in lines if line.strip()]
+    avg_line = sum(non_empty) / len(non_empty) if non_empty else max_chars
+    size = max(1, int(max_chars // avg_line))
+    start = interesting_window(lines, size)
+    return '\n'.join(lines[start:start + size])[:max_chars]
+
+
 class GitHubExtractor:
     def __init__(self, github_token: str = None):
         """
@@ -332,11 +382,7 @@ class GitHubExtractor:
         import os
 
         # File extensions we want to extract (actual code, not binaries)
-        code_extensions = {
-            '.py', '.js', '.ts', '.jsx', '.tsx', '.rs', '.go', '.java', '.c', '.cpp',
-            '.h', '.hpp', '.cs', '.rb', '.php', '.swift', '.kt', '.scala', '.sh',
-            '.toml', '.yaml', '.yml', '.json', '.xml', '.sql', '.md'
-        }
+        code_extensions = set(EXTENSION_LANGUAGES)
 
         # Important file name patterns
         important_names = {
@@ -390,7 +436,8 @@ class GitHubExtractor:
             scored_files.append({
                 'path': path,
                 'size': size,
-                'score': score
+                'score': score,
+                'language': EXTENSION_LANGUAGES[ext.lower()]
             })
 
         # Sort by score and take top 15
@@ -411,16 +458,19 @@ class GitHubExtractor:
                 content = self.get_file_content(owner, repo, path)
 
             if content:
-                # Take first 200 lines for JSON (keep it reasonable)
+                # Take the most interesting 200 lines for JSON (keep it reasonable)
                 lines = content.split('\n')
-                snippet = '\n'.join(lines[:200])
+                start = interesting_window(lines, 200)
+                snippet = '\n'.join(lines[start:start + 200])
 
                 extracted_files[path] = {
                     'full_content': content,
                     'snippet': snippet,
+                    'snippet_start_line': start + 1,
                     'lines': len(lines),
                     'size': file_info['size'],
-                    'importance_score': file_info['score']
+                    'importance_score': file_info['score'],
+                    'language': file_info['language']
                 }
 
         return extracted_files
@@ -488,12 +538,33 @@ class GitHubExtractor:
             "has_issues": len(smells) > 0
         }
 
-    def extract(self, github_url: str) -> Dict[str, Any]:
+    def analyze_repository(self, tree: List[Dict], key_files: Dict[str, str], readme: str) -> tuple:
+        """
+        CPU-bound analysis of the file tree, dependency files and README.
+
+        Returns (complexity, frameworks, readme_analysis). Kept separate from
+        the network calls so callers can run it on a worker process.
+        """
+        print("Analyzing code complexity...")
+        complexity = self.analyze_complexity(tree)
+
+        print("Detecting frameworks...")
+        frameworks = self.detect_frameworks(key_files)
+
+        print("Analyzing README for project context...")
+        readme_analysis = self.analyze_readme(readme)
+
+        return complexity, frameworks, readme_analysis
+
+    def extract(self, github_url: str, offload=None) -> Dict[str, Any]:
         """
         Main extraction method - pulls all relevant info from a GitHub repo.
 
         Args:
             github_url: Full GitHub repository URL
+            offload: Optional callable offload(fn, *args, size=...) that runs
+                CPU-bound analysis elsewhere (e.g. a process pool); defaults
+                to running it inline
 
         Returns:
             Dictionary containing all extracted repository information
@@ -517,14 +588,14 @@ class GitHubExtractor:
         } if total_bytes > 0 else {}
 
         # NEW: Perform analysis for image generation and placard creation
-        print("Analyzing code complexity...")
-        complexity = self.analyze_complexity(tree)
-
-        print("Detecting frameworks...")
-        frameworks = self.detect_frameworks(key_files)
-
-        print("Analyzing README for project context...")
-        readme_analysis = self.analyze_readme(readme)
+        if offload is None:
+            complexity, frameworks, readme_analysis = self.analyze_repository(tree, key_files, readme)
+        else:
+            # Rough work size: README text plus ~100 chars of path/metadata per tree entry
+            size = len(readme or "") + 100 * len(tree)
+            complexity, frameworks, readme_analysis = offload(
+                self.analyze_repository, tree, key_files, readme, size=size
+            )
 
         print("Extracting important code files...")
         important_files = self.extract_important_files(owner, repo, tree, key_files)
@@ -556,9 +627,11 @@ class GitHubExtractor:
                 "important_files": {
                     path: {
                         "snippet": data["snippet"],
+                        "snippet_start_line": data["snippet_start_line"],
                         "lines": data["lines"],
                         "size": data["size"],
                         "importance_score": data["importance_score"],
+                        "language": data["language"],
                         "saved_to": f"code_samples/{path.replace('/', '_')}"
                     }
                     for path, data in important_files.items()
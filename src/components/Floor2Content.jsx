@@ -1,6 +1,6 @@
 import { useState } from 'react'
 import { motion, AnimatePresence } from 'framer-motion'
-import { searchMetLocal } from '@/lib/metLocalSearch'
+import { searchMetLocalStream } from '@/lib/metLocalSearch'
 import DecryptedText from './DecryptedText'
 
 export default function Floor2Content() {
@@ -22,14 +22,17 @@ export default function Floor2Content() {
     setStatus('Searching Met Museum collection...')
 
     try {
-      const results = await searchMetLocal(keywords)
+      // Show each artwork as soon as the backend streams it
+      const { results } = await searchMetLocalStream(keywords, (artwork) => {
+        setArtworks(prev => [...prev, artwork])
+        setStatus('')
+      })
       if (results.length === 0) {
         setError('No results found for this search.')
         setStatus('')
         setGenerating(false)
         return
       }
-      setArtworks(results)
       setStatus('')
     } catch (err) {
       setError(err.message || 'Search failed. Please try again.')
@@ -8,6 +8,56 @@ const ArtContext = createContext({
   setGithubUrl: () => {}
 })
 
+/**
+ * Stream a placard from /api/placard/stream, calling onDescription with the
+ * description text so far. Resolves to the final placard; throws with
+ * err.placardFailed set when the backend reports a failure.
+ */
+async function streamPlacard(body, onDescription) {
+  const response = await fetch('/api/placard/stream', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  })
+
+  if (!response.ok) {
+    const err = await response.json().catch(() => ({}))
+    throw Object.assign(new Error(err.detail || String(response.status)), { placardFailed: true })
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  let description = ''
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const raw = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      const event = raw.match(/^event: (.*)$/m)?.[1]
+      const data = raw.match(/^data: (.*)$/m)?.[1]
+      if (!event || !data) continue
+      const payload = JSON.parse(data)
+
+      if (event === 'delta') {
+        description += payload.text
+        onDescription(description)
+      } else if (event === 'placard') {
+        return payload
+      } else if (event === 'error') {
+        throw Object.assign(new Error(payload.error), { placardFailed: true })
+      }
+    }
+  }
+
+  throw new Error('Placard stream ended early')
+}
+
 export function ArtProvider({ children }) {
   const [artworks, setArtworks] = useState([])
   const [images, setImages] = useState({})
@@ -50,13 +100,16 @@ export function ArtProvider({ children }) {
         const { data: repoData } = await extractRes.json()
         const repoMetadata = repoData.metadata
         const importantFiles = repoData.analysis?.important_files || {}
+        // Whole file text lives only in extracted_code_files; important_files carries the snippet
+        const extractedFiles = repoData.extracted_code_files || {}
 
         console.log(`%c[Syntaxesia] Extracted ${Object.keys(importantFiles).length} files from ${repoMetadata.name}`, 'color: #ffd600')
 
         // Step 2: Select top 10 files by importance score
         const filesArray = Object.entries(importantFiles).map(([path, fileData]) => ({
           path,
-          ...fileData
+          ...fileData,
+          full_content: extractedFiles[path]?.full_content
         }))
 
         filesArray.sort((a, b) => (b.importance_score || 0) - (a.importance_score || 0))
@@ -129,8 +182,12 @@ export function ArtProvider({ children }) {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
-                  code: file.snippet || '',
-                  language: getLanguage(file.path)
+                  // Metrics describe the whole file, not just the 200-line snippet
+                  code: file.full_content || file.snippet || '',
+                  language: getLanguage(file.path),
+                  file_path: file.path,
+                  // Same file -> same prompt, so revisiting an exhibition hits the image cache
+                  deterministic: true
                 }),
               })
 
@@ -161,14 +218,14 @@ export function ArtProvider({ children }) {
               )
 
               // Store image immediately so it shows in gallery
-              setImages(prev => ({ ...prev, [artworkId]: imageData.image_data_url }))
+              setImages(prev => ({ ...prev, [artworkId]: imageData.image_url }))
 
               // Generate placard from the Imagen prompt + code context
               const placardStartTime = performance.now()
-              const placardRes = await fetch('/api/placard', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
+              // Description streams into the placeholder frame as Claude writes it
+              let placard
+              try {
+                placard = await streamPlacard({
                   imagen_prompt: imageData.prompt_used,
                   code_snippet: file.snippet || '',
                   file_path: file.path,
@@ -176,13 +233,15 @@ export function ArtProvider({ children }) {
                   repo_name: repoName,
                   username: username,
                   year: year
-                }),
-              })
-
-              if (!placardRes.ok) {
-                const err = await placardRes.json().catch(() => ({}))
+                }, (description) => {
+                  setArtworks(prev => prev.map(a => (
+                    a.id === artworkId ? { ...a, placard: { ...a.placard, description } } : a
+                  )))
+                })
+              } catch (err) {
+                if (!err.placardFailed) throw err
                 console.error(
-                  `%c[Syntaxesia] [${artworkId}/10] Placard generation FAILED: ${err.detail || placardRes.status}`,
+                  `%c[Syntaxesia] [${artworkId}/10] Placard generation FAILED: ${err.message}`,
                   'color: #ff1744'
                 )
                 // Return artwork with minimal placard
@@ -201,7 +260,6 @@ export function ArtProvider({ children }) {
                 }
               }
 
-              const placard = await placardRes.json()
               const placardElapsed = ((performance.now() - placardStartTime) / 1000).toFixed(1)
               const totalElapsed = ((performance.now() - startTime) / 1000).toFixed(1)
 
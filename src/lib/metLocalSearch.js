@@ -17,3 +17,50 @@ export async function searchMetLocal(searchKeywords) {
   console.log(`[Met] Got ${results.length} artworks by women artists`)
   return results
 }
+
+/**
+ * Streaming variant: calls onArtwork for each result as soon as the backend finds it.
+ * Resolves to { results, cursor }; pass the cursor back to continue the same search.
+ */
+export async function searchMetLocalStream(searchKeywords, onArtwork, cursor = null) {
+  const params = new URLSearchParams({ q: searchKeywords })
+  if (cursor) params.set('cursor', cursor)
+
+  const response = await fetch(`/api/met/women-artists/stream?${params.toString()}`)
+
+  if (!response.ok) {
+    const text = await response.text()
+    console.error('[Met] Backend error:', text)
+    throw new Error('Search failed. Please try different keywords.')
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  const results = []
+  let nextCursor = null
+  let buffered = ''
+
+  const handleLine = (line) => {
+    if (!line.trim()) return
+    const message = JSON.parse(line)
+    if (message.artwork) {
+      results.push(message.artwork)
+      onArtwork?.(message.artwork)
+    } else if ('cursor' in message) {
+      nextCursor = message.cursor
+    }
+  }
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffered += decoder.decode(value, { stream: true })
+    const lines = buffered.split('\n')
+    buffered = lines.pop()
+    lines.forEach(handleLine)
+  }
+  handleLine(buffered)
+
+  console.log(`[Met] Streamed ${results.length} artworks by women artists`)
+  return { results, cursor: nextCursor }
+}
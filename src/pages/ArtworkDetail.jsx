@@ -101,7 +101,7 @@ export default function ArtworkDetail() {
 
     // If was playing, restart with new voice and seek to same position
     if (wasPlaying && ttsText) {
-      const params = new URLSearchParams({ text: ttsText })
+      const params = new URLSearchParams({ text: ttsText, parallel: 'true' })
       params.set('voice_id', newVoiceId)
       const audio = new Audio(`/api/tts?${params.toString()}`)
       audio.onended = () => { audioRef.current = null; setIsPlaying(false) }
@@ -130,7 +130,7 @@ export default function ArtworkDetail() {
       return
     }
 
-    const params = new URLSearchParams({ text: ttsText })
+    const params = new URLSearchParams({ text: ttsText, parallel: 'true' })
     if (voiceId) {
       params.set('voice_id', voiceId)
     }